@@ -0,0 +1,84 @@
+"""Compares validated and trusted loading of stored games.
+
+Run from the repository root:
+
+    python -m benchmarks.game_loading
+"""
+import json
+
+from benchmarks.terrain_generation import timeit
+from src.game_logic.board import HexBoard, HexCoord
+from src.game_logic.city import City
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.units import Unit, UnitType, Worker
+
+# radius, units, cities, workers per city
+SIZES = [(10, 10, 2, 5), (25, 200, 10, 20), (50, 1000, 50, 40)]
+N_PLAYERS = 4
+
+
+def build_game(radius: int, n_units: int, n_cities: int, n_workers: int):
+    center = HexCoord(0, 0, 0)
+    ring = list(center.ring(radius // 2))
+    units = [
+        Unit(
+            location=location,
+            owner_id=idx % N_PLAYERS,
+            id=idx,
+            type=list(UnitType)[idx % len(UnitType)],
+            actions=0,
+        )
+        for idx, location in zip(range(n_units), center.range(radius))
+    ]
+    cities = []
+    for idx in range(n_cities):
+        location = ring[idx * len(ring) // n_cities]
+        workers = [
+            Worker(
+                location=HexCoord(
+                    location.q, location.r + 1 + w, location.s - 1 - w
+                ),
+                id=idx * n_workers + w,
+                yields=1,
+            )
+            for w in range(n_workers)
+        ]
+        cities.append(
+            City(
+                location=location,
+                owner_id=idx % N_PLAYERS,
+                id=idx,
+                name=str(idx),
+                workers=workers,
+            )
+        )
+    return Game(
+        board=HexBoard.build_circular(radius, seed=0),
+        players=[Player(id=i, budget=10) for i in range(N_PLAYERS)],
+        units=units,
+        cities=cities,
+        current_player_idx=0,
+    )
+
+
+def main():
+    print(
+        f"{'radius':>6} {'units':>6} {'workers':>8} {'validated [ms]':>15} "
+        f"{'trusted [ms]':>13} {'x':>5}"
+    )
+    for radius, n_units, n_cities, n_workers in SIZES:
+        game = build_game(radius, n_units, n_cities, n_workers)
+        # as read back from a storage file
+        game_json = json.dumps(game.to_packed_dict(include_rng=True))
+        validated = timeit(lambda: Game(**json.loads(game_json)))
+        trusted = timeit(lambda: Game.from_trusted_dict(json.loads(game_json)))
+        print(
+            f"{radius:>6} {n_units:>6} {n_cities * n_workers:>8} "
+            f"{validated * 1000:>15.3f} {trusted * 1000:>13.3f} "
+            f"{validated / trusted:>5.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
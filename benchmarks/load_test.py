@@ -0,0 +1,99 @@
+"""Load test of the api, requests per second with concurrent clients.
+
+Start the server, then run from the repository root:
+
+    uvicorn src.app.main:app --port 8000
+    python -m benchmarks.load_test --url http://127.0.0.1:8000
+
+Every client plays its own game: it ends its turn and polls the game changes,
+as a client of the delta api does.
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+import httpx
+
+
+async def run_client(
+    client: httpx.AsyncClient,
+    game_id: int,
+    deadline: float,
+    latencies: List[float],
+) -> None:
+    action = {
+        "action_type": "end_turn",
+        "params": {"game_id": game_id, "player_id": 0},
+    }
+    version = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.post(
+            "/action", params={"delta": True}, json=action
+        )
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = await client.get(
+            "/game", params={"game_id": game_id, "since_version": version}
+        )
+        response.raise_for_status()
+        version = response.json()["version"]
+        latencies.append(time.perf_counter() - start)
+
+
+async def load_test(
+    url: str, n_clients: int, duration: float, first_game_id: int
+) -> None:
+    limits = httpx.Limits(max_connections=n_clients)
+    async with httpx.AsyncClient(
+        base_url=url, limits=limits, timeout=30
+    ) as client:
+        game_ids = range(first_game_id, first_game_id + n_clients)
+        for game_id in game_ids:
+            response = await client.post(
+                "/new_game",
+                params={"game_id": game_id, "radius": 10, "n_players": 1},
+            )
+            response.raise_for_status()
+
+        latencies: List[float] = []
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                run_client(client, game_id, start + duration, latencies)
+                for game_id in game_ids
+            )
+        )
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(
+        f"{n_clients} clients, {len(latencies)} requests in {elapsed:.1f} s: "
+        f"{len(latencies) / elapsed:.0f} requests/s, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--first-game-id",
+        type=int,
+        default=100000,
+        help="games first-game-id... are created, one per client",
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        load_test(args.url, args.clients, args.duration, args.first_game_id)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Compares the game serializers, for storage and for the api responses.
+
+Run from the repository root:
+
+    python -m benchmarks.serialization
+"""
+import json
+
+from benchmarks.game_loading import build_game
+from benchmarks.terrain_generation import timeit
+from src.game_logic.game import Game
+from src.game_logic.serialization import SERIALIZERS, set_serializer
+
+# radius, units, cities, workers per city
+SIZES = [(5, 5, 2, 2), (10, 10, 2, 5), (25, 200, 10, 20), (50, 1000, 50, 40)]
+
+
+def main():
+    print(
+        f"{'radius':>6} {'serializer':>10} {'store [ms]':>11} "
+        f"{'load [ms]':>10} {'response [ms]':>14} {'kB':>6}"
+    )
+    for radius, n_units, n_cities, n_workers in SIZES:
+        game = build_game(radius, n_units, n_cities, n_workers)
+
+        # before: json of the intermediate dicts
+        stored = json.dumps(game.to_packed_dict(include_rng=True))
+        store = timeit(
+            lambda: json.dumps(game.to_packed_dict(include_rng=True))
+        )
+        load = timeit(lambda: Game.from_trusted_dict(json.loads(stored)))
+        response = timeit(lambda: json.dumps(game.model_dump(mode="json")))
+        print(
+            f"{radius:>6} {'dict+json':>10} {store * 1000:>11.3f} "
+            f"{load * 1000:>10.3f} {response * 1000:>14.3f} "
+            f"{len(stored) / 1000:>6.1f}"
+        )
+
+        for name, serializer_class in SERIALIZERS.items():
+            set_serializer(name)
+            serializer = serializer_class()
+            stored = game.to_packed_json(include_rng=True)
+            store = timeit(lambda: game.to_packed_json(include_rng=True))
+            load = timeit(
+                lambda: Game.from_trusted_dict(serializer.loads(stored))
+            )
+            response = timeit(lambda: serializer.dumps(game))
+            print(
+                f"{radius:>6} {name:>10} {store * 1000:>11.3f} "
+                f"{load * 1000:>10.3f} {response * 1000:>14.3f} "
+                f"{len(stored) / 1000:>6.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Compares id allocation and listing of the file and SQLite storages.
+
+Run from the repository root:
+
+    python -m benchmarks.storage
+"""
+import tempfile
+
+from benchmarks.terrain_generation import timeit
+from src.game_logic.board import HexBoard
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.sqlite_storage import SqliteStorage
+from src.game_logic.storage import FileStorage
+
+N_GAMES = [100, 1000, 5000]
+
+
+def main():
+    game = Game.build_empty(
+        board=HexBoard.build_circular(3),
+        players=[Player(id=i, budget=10) for i in range(2)],
+    )
+    print(
+        f"{'games':>6} {'storage':>8} {'new id [ms]':>12} "
+        f"{'list 20 [ms]':>13} {'load [ms]':>10}"
+    )
+    for n_games in N_GAMES:
+        for storage_class in [FileStorage, SqliteStorage]:
+            with tempfile.TemporaryDirectory() as tempdir:
+                storage = storage_class(tempdir)
+                for game_id in range(n_games):
+                    storage.save(game_id, game)
+                # ids allocated but never saved
+                new_id = timeit(storage.new_id)
+                list_games = timeit(lambda: storage.list_games(limit=20))
+                load = timeit(lambda: storage.load(n_games // 2))
+                print(
+                    f"{n_games:>6} {storage_class.__name__[:-7]:>8} "
+                    f"{new_id * 1000:>12.3f} {list_games * 1000:>13.3f} "
+                    f"{load * 1000:>10.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compares the vectorized terrain generation with the former per cell one.
+
+Run from the repository root:
+
+    python -m benchmarks.terrain_generation
+"""
+import time
+from typing import Callable, List
+
+from perlin_noise import PerlinNoise
+
+from src.game_logic.terrain_generation.perlin_noise import (
+    OCTAVES,
+    THRESHOLDS,
+    generate_world,
+)
+
+RADII = [5, 10, 25, 50, 100]
+
+
+def generate_world_per_cell(width: int, height: int) -> List[List[int]]:
+    # terrain generation before vectorization
+    noise = PerlinNoise(octaves=OCTAVES)
+    noise_discrete = [
+        [noise([i / 10, j / 10]) for j in range(width)] for i in range(height)
+    ]
+
+    def digitalize(elem: float, thresholds: List[float]):
+        for i, th in enumerate(thresholds):
+            if elem <= th:
+                return i
+        return len(thresholds)
+
+    return [
+        [digitalize(elem, THRESHOLDS) for elem in row]
+        for row in noise_discrete
+    ]
+
+
+def timeit(function: Callable[[], object], min_time: float = 0.5) -> float:
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > min_time:
+            return elapsed / runs
+
+
+def main():
+    print(f"{'radius':>6} {'per cell [ms]':>14} {'numpy [ms]':>11} {'x':>7}")
+    for radius in RADII:
+        side_size = 2 * radius + 1
+        per_cell = timeit(
+            lambda: generate_world_per_cell(side_size, side_size)
+        )
+        vectorized = timeit(lambda: generate_world(side_size, side_size))
+        print(
+            f"{radius:>6} {per_cell * 1000:>14.2f} {vectorized * 1000:>11.3f} "
+            f"{per_cell / vectorized:>7.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+from src.game_logic.delta import GameDelta
+from src.game_logic.serialization import get_serializer
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUE = 256
+
+
+class GameHub:
+    """In-process pub/sub of game deltas, one queue per subscriber.
+
+    Subscribers live on the event loop. Deltas can be published from any
+    thread, they are serialized once and handed over to the loop. A
+    subscriber that falls MAX_QUEUE messages behind is dropped: its queue
+    gets None and the client must catch up with GET /game?since_version.
+    """
+
+    def __init__(self, max_queue: int = MAX_QUEUE):
+        self.max_queue = max_queue
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, game_id: int) -> asyncio.Queue:
+        # call from the event loop
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue)
+        self._subscribers.setdefault(game_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, game_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(game_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[game_id]
+
+    def publish(self, game_id: int, delta: GameDelta) -> None:
+        # call while the game is locked, so that the delta is serialized
+        # before the next action changes its units
+        if game_id not in self._subscribers or self._loop is None:
+            return
+        self.publish_message(game_id, get_serializer().dumps(delta).decode())
+
+    def publish_message(self, game_id: int, message: str) -> None:
+        # publishes a delta already serialized, e.g. by a game shard
+        if game_id not in self._subscribers or self._loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._broadcast(game_id, message)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._broadcast, game_id, message)
+
+    def _broadcast(self, game_id: int, message: str) -> None:
+        for queue in list(self._subscribers.get(game_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning(f"Dropping slow subscriber of game {game_id}")
+                self.unsubscribe(game_id, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def __len__(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+
+hub = GameHub()
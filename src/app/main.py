@@ -1,39 +1,315 @@
-from typing import Optional, Tuple
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Callable, List, Optional, Tuple, Union
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
 
-from src.game_logic.actions import Action, take_action
-from src.game_logic.board import HexBoard
-from src.game_logic.exceptions import IllegalActionException
-from src.game_logic.game import Game, get_game, new_game
+from src.app.hub import hub
+from src.app.responses import FastJSONResponse
+from src.game_logic.actions import (
+    Action,
+    ActionParamAttack,
+    action_log_storage,
+    add_action_listener,
+    attack_win_probability,
+    take_action_async,
+    take_action_delta_async,
+)
+from src.game_logic.archive import archiving_storage
+from src.game_logic.board_cache import board_pool, get_board
+from src.game_logic.delta import GameDelta, game_json
+from src.game_logic.exceptions import (
+    GameConflictException,
+    IllegalActionException,
+)
+from src.game_logic.game import Game
+from src.game_logic.legal_actions import legal_actions
+from src.game_logic.metrics import (
+    CONTENT_TYPE,
+    registry,
+    timed_operation,
+    timed_phase,
+)
 from src.game_logic.player import Player
+from src.game_logic.session import (
+    flush_sessions,
+    get_game_async,
+    get_session_store,
+    new_game_async,
+    set_shared_storage,
+    set_storage_factory,
+)
+from src.game_logic.shards import ShardPool
+from src.game_logic.sqlite_storage import SqliteStorage
+from src.game_logic.storage import GAMES_DIR, FileStorage, GameInfo, Storage
 
-app = FastAPI()
+storage_factory: Callable[[str], Storage] = FileStorage
+if os.environ.get("GAME_STORAGE") == "action_log":
+    storage_factory = action_log_storage
+elif os.environ.get("GAME_STORAGE") == "sqlite":
+    storage_factory = SqliteStorage
+# games idle for that many seconds are moved to data/games/archive.jsonl.gz
+if os.environ.get("GAME_ARCHIVE_TTL"):
+    storage_factory = partial(
+        archiving_storage,
+        storage_factory,
+        ttl=float(os.environ["GAME_ARCHIVE_TTL"]),
+    )
+set_storage_factory(storage_factory)
+# required when several workers serve the same games
+if os.environ.get("GAME_SHARED_STORAGE") == "1":
+    set_shared_storage(True)
+add_action_listener(hub.publish)
+
+# with GAME_SHARDS=n, games are owned by n worker processes and the
+# endpoints forward to them. Each uvicorn worker starts its own shards,
+# which lock the games in the storage: run a single uvicorn worker
+n_shards = int(os.environ.get("GAME_SHARDS", "0"))
+shard_pool = (
+    ShardPool(n_shards, GAMES_DIR, storage_factory) if n_shards else None
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    board_pool.start()
+    if shard_pool is not None:
+        shard_pool.start()
+    yield
+    if shard_pool is not None:
+        shard_pool.stop()
+    board_pool.stop()
+    flush_sessions()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_LINES = 40
+_profile_lock = asyncio.Lock()
+
+
+async def profile_middleware(request: Request, call_next):
+    # Runs the request under cProfile and answers with the profile, sorted
+    # by the header value (cumulative by default), instead of the response.
+    # Only the event loop thread is profiled, including whatever else runs
+    # in it meanwhile; work in threads and shards is not.
+    if PROFILE_HEADER not in request.headers:
+        return await call_next(request)
+    sort = request.headers[PROFILE_HEADER]
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        sort = "cumulative"
+    # one profiler at a time per thread
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = await call_next(request)
+            async for _ in response.body_iterator:
+                pass
+        finally:
+            profiler.disable()
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(
+        PROFILE_LINES
+    )
+    return PlainTextResponse(
+        stream.getvalue(),
+        headers={"x-profiled-status": str(response.status_code)},
+    )
+
+
+# with GAME_PROFILING=1, requests with an X-Profile header are profiled
+if os.environ.get("GAME_PROFILING") == "1":
+    app.middleware("http")(profile_middleware)
+
+
+# The endpoints are async: games are in memory most of the time and their
+# work is short. Loading and storing run in worker threads.
 
 
-@app.get("/game")
-def get_game_endpoint(game_id: int) -> Game:
-    return get_game(game_id)
+@app.get("/game", response_model=Union[Game, GameDelta])
+async def get_game_endpoint(
+    game_id: int,
+    packed_board: bool = False,
+    since_version: Optional[int] = None,
+):
+    # with since_version, only the changes since that version, or the full
+    # game if they are not known anymore
+    with timed_operation("get_game"):
+        if shard_pool is not None:
+            with timed_phase("shard"):
+                content = await shard_pool.call(
+                    game_id, "get_game", packed_board, since_version
+                )
+            return FastJSONResponse(content)
+        async with get_session_store().acquire_async(game_id) as game:
+            with timed_phase("serialize"):
+                return FastJSONResponse(
+                    game_json(game, packed_board, since_version)
+                )
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    # Prometheus text format, summed over the shards if any
+    others = []
+    if shard_pool is not None:
+        others = await shard_pool.collect_metrics()
+    return Response(content=registry.render(*others), media_type=CONTENT_TYPE)
 
 
-@app.post("/action")
-def post_action_endpoint(action: Action) -> Game:
-    game = take_action(action=action)
-    return game
+@app.get("/games")
+async def list_games_endpoint(
+    limit: int = 100,
+    before: Optional[float] = None,
+    before_id: Optional[int] = None,
+) -> List[GameInfo]:
+    # most recently updated games first, as last written to the storage.
+    # Page with before=<updated_at>&before_id=<id> of the last game listed
+    return await run_in_threadpool(
+        get_session_store().storage.list_games, limit, before, before_id
+    )
+
+
+@app.get("/game/{game_id}/legal_actions")
+async def legal_actions_endpoint(
+    game_id: int, player_id: Optional[int] = None
+) -> List[Action]:
+    # legal actions of player_id, of the current player by default
+    if shard_pool is not None:
+        return FastJSONResponse(
+            await shard_pool.call(game_id, "legal_actions", player_id)
+        )
+    async with get_session_store().acquire_async(game_id) as game:
+        if player_id is None:
+            player_id = game.current_player.id
+        return legal_actions(game, player_id, game_id)
+
+
+@app.websocket("/game/{game_id}/updates")
+async def game_updates_endpoint(
+    websocket: WebSocket, game_id: int, since_version: Optional[int] = None
+):
+    # pushes the delta of every action on the game. With since_version, the
+    # first message brings the client up to date, as GET /game does
+    await websocket.accept()
+    queue = hub.subscribe(game_id)
+    try:
+        if since_version is not None:
+            response = await get_game_endpoint(
+                game_id, since_version=since_version
+            )
+            await websocket.send_text(response.body.decode())
+
+        async def forward():
+            while True:
+                message = await queue.get()
+                if message is None:
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                    return
+                await websocket.send_text(message)
+
+        async def wait_disconnect():
+            while (await websocket.receive())[
+                "type"
+            ] != "websocket.disconnect":
+                pass
+
+        tasks = [
+            asyncio.create_task(forward()),
+            asyncio.create_task(wait_disconnect()),
+        ]
+        _, pending = await asyncio.wait(
+            tasks, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(game_id, queue)
+
+
+@app.get("/board")
+async def get_board_endpoint(game_id: int) -> Response:
+    if shard_pool is not None:
+        content = await shard_pool.call(game_id, "get_board")
+    else:
+        content = (await get_game_async(game_id)).board.to_bytes()
+    return Response(content=content, media_type="application/octet-stream")
+
+
+@app.post("/action", response_model=Union[Game, GameDelta])
+async def post_action_endpoint(action: Action, delta: bool = False):
+    # with delta, only what the action changed
+    with timed_operation("take_action"):
+        if shard_pool is not None:
+            game_id = action.params.game_id
+            with timed_phase("shard"):
+                response, delta_json = await shard_pool.call(
+                    game_id, "take_action", action.model_dump_json(), delta
+                )
+            hub.publish_message(game_id, delta_json.decode())
+            return FastJSONResponse(response)
+        if delta:
+            result = await take_action_delta_async(action=action)
+        else:
+            result = await take_action_async(action=action)
+        with timed_phase("serialize"):
+            return FastJSONResponse(result)
+
+
+@app.post("/attack_probability")
+async def attack_probability_endpoint(params: ActionParamAttack) -> float:
+    if shard_pool is not None:
+        return await shard_pool.call(
+            params.game_id, "attack_probability", params.model_dump_json()
+        )
+    async with get_session_store().acquire_async(params.game_id) as game:
+        return attack_win_probability(game, params)
 
 
 @app.post("/new_game")
-def new_game_endpoint(
-    game_id: Optional[int], radius: int, n_players: int
+async def new_game_endpoint(
+    game_id: Optional[int],
+    radius: int,
+    n_players: int,
+    seed: Optional[int] = None,
 ) -> Tuple[Game, int]:
-    board = HexBoard.build_circular(radius=radius)
-    game = Game.build_empty(
-        board=board,
-        players=[Player(id=i, budget=10) for i in range(n_players)],
-    )
-    game_id = new_game(game=game, game_id=game_id)
-    return game, game_id
+    with timed_operation("new_game"):
+        # boards are generated, or read from the board cache, in a thread
+        with timed_phase("board"):
+            board = await run_in_threadpool(
+                get_board, radius=radius, seed=seed
+            )
+        with timed_phase("build"):
+            game = Game.build_empty(
+                board=board,
+                players=[Player(id=i, budget=10) for i in range(n_players)],
+            )
+        if shard_pool is not None:
+            if game_id is None:
+                # the id is claimed in the storage, then the game is routed
+                game_id = await run_in_threadpool(
+                    get_session_store().storage.new_id
+                )
+            with timed_phase("shard"):
+                await shard_pool.call(
+                    game_id, "new_game", game.to_packed_json(include_rng=True)
+                )
+        else:
+            with timed_phase("create"):
+                game_id = await new_game_async(game=game, game_id=game_id)
+        with timed_phase("serialize"):
+            return FastJSONResponse([game, game_id])
 
 
 @app.exception_handler(IllegalActionException)
@@ -44,3 +320,13 @@ def unsupported_language_exception_handler(
         status_code=400,
         content={"message": f"IllegalActionException: {str(exc)}"},
     )
+
+
+@app.exception_handler(GameConflictException)
+def game_conflict_exception_handler(
+    request: Request, exc: GameConflictException
+):
+    return JSONResponse(
+        status_code=409,
+        content={"message": f"GameConflictException: {str(exc)}"},
+    )
@@ -0,0 +1,15 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from src.game_logic.serialization import get_serializer
+
+
+class FastJSONResponse(JSONResponse):
+    # Renders with the configured serializer. Return it directly from the
+    # endpoints, so that FastAPI does not turn the models into dicts first.
+    # Bytes are sent as they are, e.g. Game.to_packed_json()
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return get_serializer().dumps(content)
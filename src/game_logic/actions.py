@@ -1,14 +1,26 @@
-import json
 import logging
-import os
 from enum import Enum
-from typing import List, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 from pydantic import BaseModel, ConfigDict, field_validator
 
 from src.game_logic.board import HexCoord
-from src.game_logic.exceptions import IllegalActionException
+from src.game_logic.delta import (
+    GameDelta,
+    delta_history,
+    game_delta,
+    game_state,
+)
+from src.game_logic.dice import DiceSet, sum_distribution, win_probability
+from src.game_logic.exceptions import (
+    GameConflictException,
+    IllegalActionException,
+)
 from src.game_logic.game import Game
+from src.game_logic.metrics import Counter, registry, timed_phase
+from src.game_logic.session import get_session_store
+from src.game_logic.storage import GAMES_DIR, ActionLogStorage
 from src.game_logic.units import Unit, UnitStats, UnitType, Worker
 
 logger = logging.getLogger(__name__)
@@ -22,10 +34,25 @@ class ActionType(Enum):
     end_turn = "end_turn"
 
 
+ACTIONS_TAKEN = registry.register(
+    Counter("game_actions_total", "Actions taken, by type", ["action_type"])
+)
+ILLEGAL_ACTIONS = registry.register(
+    Counter(
+        "game_illegal_actions_total",
+        "Actions rejected as illegal, by type and reason",
+        ["action_type", "reason"],
+    )
+)
+
+
 class ActionParam(BaseModel):
     model_config = ConfigDict(extra="forbid")
     game_id: int
     player_id: int
+    # version of the game the action was decided on, the action is rejected
+    # if the game changed since
+    expected_version: Optional[int] = None
 
 
 class ActionParamMoveUnit(ActionParam):
@@ -58,6 +85,7 @@ class Action(BaseModel):
         ActionParamMoveUnit,
         ActionParamAttack,
         ActionParamBuildUnit,
+        ActionParamBuildWorker,
         ActionParamEndTurn,
     ]
 
@@ -79,27 +107,43 @@ class Action(BaseModel):
 def action_move_unit(game: Game, params: ActionParamMoveUnit):
     if game.unit_from_location(params.move_to) is not None:
         raise IllegalActionException(
-            f"Moving to occupied cell {params.move_to}"
+            f"Moving to occupied cell {params.move_to}", reason="occupied_cell"
         )
 
     unit = game.unit_from_id(params.unit_id)
     if unit.owner_id != params.player_id:
         raise IllegalActionException(
-            f"Player {params.player_id} doesn't own the unit {params.unit_id}"
+            f"Player {params.player_id} doesn't own the unit {params.unit_id}",
+            reason="not_owner",
         )
-    unit.move_to(to=params.move_to, board=game.board)
+    game.move_unit(unit, params.move_to)
+
+
+def attack_dice(attacking_unit: Unit, attacked_unit: Unit) -> DiceSet:
+    if attacking_unit.location.distance(attacked_unit.location) > 1:
+        return attacking_unit.stats.attack_ranged
+    if (
+        attacked_unit.stats.attack_melee.expected()
+        >= attacked_unit.stats.attack_ranged.expected()
+    ):
+        return attacking_unit.stats.attack_melee
+    return attacking_unit.stats.attack_ranged
 
 
-def action_attack(game: Game, params: ActionParamAttack):
+def attack_units(
+    game: Game, params: ActionParamAttack
+) -> Tuple[List[Unit], Unit]:
+    # attacking and attacked units, after checking that the attack is legal
     attacked_unit = game.unit_from_id(params.attacked_unit_id)
     if attacked_unit is None:
         raise IllegalActionException(
-            f"Unit {params.attacked_unit_id} not found"
+            f"Unit {params.attacked_unit_id} not found", reason="unknown_unit"
         )
     if attacked_unit.owner_id == params.player_id:
         raise IllegalActionException(
             f"""Player {params.player_id} cannot attach unit
-            {attacked_unit.owner_id} as he is the owner"""
+            {attacked_unit.owner_id} as he is the owner""",
+            reason="own_unit",
         )
 
     attacking_units: List[Unit] = []
@@ -107,11 +151,11 @@ def action_attack(game: Game, params: ActionParamAttack):
         unit = game.unit_from_id(attacking_unit_id)
         if unit.owner_id != params.player_id:
             raise IllegalActionException(
-                f"Player {params.player_id} doesn't own the unit {unit.id}"
+                f"Player {params.player_id} doesn't own the unit {unit.id}",
+                reason="not_owner",
             )
         attacking_units.append(unit)
 
-    attacking_roll = 0
     for attacking_unit in attacking_units:
         if attacking_unit.location.distance(attacked_unit.location) == 0:
             raise AssertionError(
@@ -121,54 +165,73 @@ def action_attack(game: Game, params: ActionParamAttack):
         if attacking_unit.location.distance(attacked_unit.location) > 1:
             if attacking_unit.stats.attack_melee.is_zero:
                 raise IllegalActionException(
-                    f"Unit {attacking_unit} is melee, but attacking as ranged"
+                    f"Unit {attacking_unit} is melee, but attacking as ranged",
+                    reason="out_of_range",
                 )
-            attacking_roll += attacking_unit.stats.attack_ranged.roll()
-        if attacking_unit.location.distance(attacked_unit.location) == 1:
-            if (
-                attacked_unit.stats.attack_melee.expected()
-                >= attacked_unit.stats.attack_ranged.expected()
-            ):
-                attacking_roll += attacking_unit.stats.attack_melee.roll()
-            else:
-                attacking_roll += attacking_unit.stats.attack_ranged.roll()
         if attacking_unit.actions == 0:
             raise IllegalActionException(
-                f"Unit {attacking_unit} has no actions left"
+                f"Unit {attacking_unit} has no actions left",
+                reason="no_actions_left",
             )
+    return attacking_units, attacked_unit
+
 
-    attacked_roll = attacked_unit.stats.defense.roll()
+def attack_win_probability(game: Game, params: ActionParamAttack) -> float:
+    # exact probability that the attack in params destroys the attacked unit
+    attacking_units, attacked_unit = attack_units(game, params)
+    dice_sizes: List[int] = []
+    for attacking_unit in attacking_units:
+        dice_sizes += attack_dice(attacking_unit, attacked_unit).dice_sizes
+    attack = sum_distribution(tuple(sorted(dice_sizes)))
+    return win_probability(attack, attacked_unit.stats.defense.distribution())
+
+
+def action_attack(
+    game: Game,
+    params: ActionParamAttack,
+    rng: Optional[np.random.Generator] = None,
+):
+    attacking_units, attacked_unit = attack_units(game, params)
+
+    attacking_roll = 0
+    for attacking_unit in attacking_units:
+        attacking_roll += attack_dice(attacking_unit, attacked_unit).roll(rng)
+
+    attacked_roll = attacked_unit.stats.defense.roll(rng)
     logger.info(
-        f"""Units {params.attacking_unit_ids} attack {params.attacked_unit_id}.
-        Total dice {attacking_roll} vs {attacked_roll}."""
+        "Units %s attack %s. Total dice %s vs %s.",
+        params.attacking_unit_ids,
+        params.attacked_unit_id,
+        attacking_roll,
+        attacked_roll,
     )
 
     for attacking_unit in attacking_units:
         attacking_unit.actions = 0
 
     if attacking_roll > attacked_roll:
-        game.units.remove(attacked_unit)
-        # pop unit from the list
+        game.remove_unit(attacked_unit)
+        # the first melee attacker advances to the freed cell, whatever the
+        # terrain
         for attacking_unit in attacking_units:
             if (
                 attacking_unit.location.distance(attacked_unit.location) == 1
                 and attacked_unit.stats.attack_melee.expected()
                 >= attacked_unit.stats.attack_ranged.expected()
             ):
-                # needed to move
-                attacking_unit.actions += 1
-                attacking_unit.move_to(attacked_unit.location, game.board)
+                game.move_unit(attacking_unit, attacked_unit.location, cost=0)
+                break
 
 
 def action_build_unit(game: Game, params: ActionParamBuildUnit):
     city = game.city_from_id(params.city_id)
     if game.unit_from_location(city.location) is not None:
         raise IllegalActionException(
-            f"Building unit in occupied city {city.id}"
+            f"Building unit in occupied city {city.id}", reason="occupied_cell"
         )
     if city.owner_id != params.player_id:
         raise IllegalActionException(
-            f"Building unit in city not owned {city.id}"
+            f"Building unit in city not owned {city.id}", reason="not_owner"
         )
     if (
         game.player_from_id(params.player_id).budget
@@ -176,58 +239,61 @@ def action_build_unit(game: Game, params: ActionParamBuildUnit):
     ):
         raise IllegalActionException(
             f"""Player {params.player_id} doesnt have enough
-            budget to build {params.type}"""
+            budget to build {params.type}""",
+            reason="insufficient_budget",
         )
     if city.actions < 1:
         raise IllegalActionException(
             f"""City {city} doesnt have enough
-            actions to build {params.type}"""
+            actions to build {params.type}""",
+            reason="no_actions_left",
         )
     city.actions -= 1
-    idx = 0
-    for unit in game.units:
-        idx = max(unit.id, idx) + 1
 
     new_unit = Unit(
         location=city.location,
-        id=idx,
+        id=game.new_unit_id(),
         owner_id=params.player_id,
         type=params.type,
         actions=0,
     )
-    game.units.append(new_unit)
+    game.add_unit(new_unit)
 
 
 def action_build_worker(game: Game, params: ActionParamBuildWorker):
     city = game.city_from_id(params.city_id)
     if game.worker_from_location(params.location) is not None:
         raise IllegalActionException(
-            f"Building worker in occupied cell {city.id}"
+            f"Building worker in occupied cell {city.id}",
+            reason="occupied_cell",
         )
     if city.owner_id != params.player_id:
         raise IllegalActionException(
-            f"Building worker in city not owned {city.id}"
+            f"Building worker in city not owned {city.id}", reason="not_owner"
         )
     if city.actions < 1:
         raise IllegalActionException(
-            f"City {city} doesnt have enough" "actions to build worker"
+            f"City {city} doesnt have enough" "actions to build worker",
+            reason="no_actions_left",
+        )
+    if not game.board.valid_coord(params.location):
+        raise IllegalActionException(
+            f"Worker location {params.location} out of the board",
+            reason="invalid_location",
         )
     if not city.is_worker_location_valid(params.location):
-        raise IllegalActionException("Worker location not valid")
+        raise IllegalActionException(
+            "Worker location not valid", reason="invalid_location"
+        )
 
     city.actions -= 1
-    idx = 0
-    for city in game.cities:
-        for worker in city.workers:
-            idx = max(worker.id, idx) + 1
 
     new_worker = Worker(
         location=params.location,
-        id=idx,
-        owner_id=params.player_id,
+        id=game.new_worker_id(),
         yields=game.board.get_cell(params.location).yields,
     )
-    game.units.append(new_worker)
+    game.add_worker(city, new_worker)
 
 
 def action_end_turn(game: Game, params: ActionParamEndTurn):
@@ -248,35 +314,143 @@ def action_end_turn(game: Game, params: ActionParamEndTurn):
     game.current_player.budget += yields
 
 
-def take_action(action: Action, file_dir: str = "data/games") -> Game:
-    filename = os.path.join(file_dir, f"{action.params.game_id:03}.json")
-    # check if files exists
-    with open(filename, "r+") as f:
-        game_dict = json.loads(f.read())
-        game = Game(**game_dict)
+def apply_action(
+    game: Game, action: Action, rng: Optional[np.random.Generator] = None
+) -> None:
+    # dice are rolled with the game generator unless another one is given,
+    # so that replaying the actions on a snapshot gives the same outcomes
+    if game.current_player.id != action.params.player_id:
+        raise IllegalActionException(
+            f"Current player ({game.current_player.id}) is not the one "
+            f"taking the action ({action.params.player_id})",
+            reason="not_current_player",
+        )
+
+    # action params
+    if action.action_type == ActionType.move_unit:
+        action_move_unit(game, action.params)
+    elif action.action_type == ActionType.attack:
+        action_attack(game, action.params, rng or game.rng)
+    elif action.action_type == ActionType.build_unit:
+        action_build_unit(game, action.params)
+    elif action.action_type == ActionType.build_worker:
+        action_build_worker(game, action.params)
+    elif action.action_type == ActionType.end_turn:
+        action_end_turn(game, action.params)
+    game.version += 1
+
+
+def replay_action(game: Game, record: Dict) -> None:
+    apply_action(game, Action(**record["action"]))
+
+
+def action_log_storage(file_dir: str = GAMES_DIR) -> ActionLogStorage:
+    return ActionLogStorage(file_dir, replay=replay_action)
+
+
+# called with the game id and the delta of every action taken, while the
+# game is still locked
+ActionListener = Callable[[int, GameDelta], None]
+_action_listeners: List[ActionListener] = []
 
-        if game.current_player.id != action.params.player_id:
-            raise IllegalActionException(
-                f"Current player ({game.current_player.id}) is not the one "
-                f"taking the action ({action.params.player_id})"
-            )
 
-        # action params
-        if action.action_type == ActionType.move_unit:
-            action_move_unit(game, action.params)
-        elif action.action_type == ActionType.attack:
-            action_attack(game, action.params)
-        elif action.action_type == ActionType.build_unit:
-            action_build_unit(game, action.params)
-        elif action.action_type == ActionType.build_worker:
-            action_build_worker(game, action.params)
-        elif action.action_type == ActionType.end_turn:
-            action_end_turn(game, action.params)
-
-        f.seek(0)
-        f.write(json.dumps(game.model_dump(mode="json")))
-        f.truncate()
+def add_action_listener(listener: ActionListener) -> None:
+    _action_listeners.append(listener)
+
+
+def remove_action_listener(listener: ActionListener) -> None:
+    _action_listeners.remove(listener)
+
+
+def take_action(action: Action, file_dir: str = GAMES_DIR) -> Game:
+    game, _ = _take_action(action, file_dir)
+    return game
+
+
+def take_action_delta(action: Action, file_dir: str = GAMES_DIR) -> GameDelta:
+    # same as take_action, returns only what the action changed
+    _, delta = _take_action(action, file_dir)
+    return delta
+
+
+async def take_action_async(action: Action, file_dir: str = GAMES_DIR) -> Game:
+    # same as take_action, without blocking the event loop
+    game, _ = await _take_action_async(action, file_dir)
     return game
 
 
+async def take_action_delta_async(
+    action: Action, file_dir: str = GAMES_DIR
+) -> GameDelta:
+    _, delta = await _take_action_async(action, file_dir)
+    return delta
+
+
+def _take_action(action: Action, file_dir: str) -> Tuple[Game, GameDelta]:
+    # the action_* functions check everything before changing the game, so a
+    # rejected action leaves the in memory game untouched. Any other failure
+    # makes the session store drop the game, see _apply_action_delta
+    sessions = get_session_store(file_dir)
+    with sessions.acquire(action.params.game_id) as game:
+        delta, record = _apply_action_delta(game, action)
+        with timed_phase("append"):
+            sessions.append(action.params.game_id, record)
+        with timed_phase("notify"):
+            _notify_action_listeners(action.params.game_id, delta)
+    return game, delta
+
+
+async def _take_action_async(
+    action: Action, file_dir: str
+) -> Tuple[Game, GameDelta]:
+    sessions = get_session_store(file_dir)
+    async with sessions.acquire_async(action.params.game_id) as game:
+        delta, record = _apply_action_delta(game, action)
+        with timed_phase("append"):
+            await sessions.append_async(action.params.game_id, record)
+        with timed_phase("notify"):
+            _notify_action_listeners(action.params.game_id, delta)
+    return game, delta
+
+
+def _apply_action_delta(game: Game, action: Action) -> Tuple[GameDelta, Dict]:
+    # applies the action, returns its delta and its storage record
+    expected_version = action.params.expected_version
+    if expected_version is not None and expected_version != game.version:
+        raise GameConflictException(
+            f"Game is at version {game.version}, not {expected_version}"
+        )
+    with timed_phase("state"):
+        before = game_state(game)
+    try:
+        with timed_phase("rules"):
+            apply_action(game, action)
+    except IllegalActionException as e:
+        ILLEGAL_ACTIONS.inc(action.action_type.value, e.reason)
+        if game_state(game) != before:
+            # a rule checked too late, the game must not be kept as it is
+            raise RuntimeError(
+                f"Rejected {action.action_type.value} changed the game"
+            ) from e
+        raise
+    ACTIONS_TAKEN.inc(action.action_type.value)
+    with timed_phase("delta"):
+        delta = game_delta(game, before, game.version - 1)
+        delta_history(game).append(delta)
+    with timed_phase("record"):
+        record = {
+            "version": game.version,
+            "action": action.model_dump(mode="json"),
+        }
+    return delta, record
+
+
+def _notify_action_listeners(game_id: int, delta: GameDelta) -> None:
+    for listener in _action_listeners:
+        try:
+            listener(game_id, delta)
+        except Exception:
+            logger.exception("Action listener failed")
+
+
 # TODO Create test for take action with temporary file.
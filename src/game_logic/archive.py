@@ -0,0 +1,325 @@
+import argparse
+import fcntl
+import gzip
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.game_logic.actions import action_log_storage
+from src.game_logic.game import Game
+from src.game_logic.serialization import get_serializer
+from src.game_logic.session import is_resident
+from src.game_logic.sqlite_storage import SqliteStorage
+from src.game_logic.storage import (
+    GAMES_DIR,
+    LIST_LIMIT,
+    FileStorage,
+    GameInfo,
+    Storage,
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_NAME = "archive.jsonl.gz"
+ARCHIVE_TTL = 24 * 60 * 60.0
+ARCHIVE_INTERVAL = 10 * 60.0
+ARCHIVE_BATCH = 100
+
+STORAGES = {
+    "file": FileStorage,
+    "action_log": action_log_storage,
+    "sqlite": SqliteStorage,
+}
+
+# Archives are gzip compressed json lines, one game per line:
+# {"id": <game id>, "game": <game as stored>}
+
+
+def game_record(game_id: int, game: Game) -> bytes:
+    return (
+        b'{"id":%d,"game":' % game_id
+        + game.to_packed_json(include_rng=True)
+        + b"}\n"
+    )
+
+
+def parse_record(line: bytes, trusted: bool = True) -> Tuple[int, Game]:
+    record = get_serializer().loads(line)
+    if trusted:
+        return record["id"], Game.from_trusted_dict(record["game"])
+    return record["id"], Game(**record["game"])
+
+
+def read_archive(
+    path: str, trusted: bool = True
+) -> Iterator[Tuple[int, Game]]:
+    # streams the games, holding one at a time in memory. A game archived
+    # several times comes up once per version, the last one is the latest
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            yield parse_record(line, trusted)
+
+
+def write_archive(path: str, games: Iterable[Tuple[int, Game]]) -> int:
+    count = 0
+    with gzip.open(path, "wb") as f:
+        for game_id, game in games:
+            f.write(game_record(game_id, game))
+            count += 1
+    return count
+
+
+def export_games(storage: Storage, path: str) -> int:
+    # writes all the stored games to the archive at path
+    return write_archive(
+        path,
+        ((game_id, storage.load(game_id)) for game_id in storage.game_ids()),
+    )
+
+
+def import_games(storage: Storage, path: str) -> int:
+    # saves all the games of the archive at path, over existing ones
+    count = 0
+    for game_id, game in read_archive(path, trusted=False):
+        storage.save(game_id, game)
+        count += 1
+    return count
+
+
+class GameArchive:
+    """Archive of games that can be read back one by one.
+
+    Each game is appended as a gzip member of its own, so the file is still
+    a plain archive of every version archived. The index file next to it
+    has a line "<id> <offset> <length>" per member, and "<id> -1 0" when
+    the game is taken out again; the last line of a game wins.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self._index: Dict[int, Tuple[int, int]] = {}
+        self._index_size = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        # reads the index lines written since the last call, possibly by
+        # other processes. Called by the archiver and request threads
+        with self._lock:
+            try:
+                with open(self.index_path, "rb") as f:
+                    f.seek(self._index_size)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            # a line can be half written
+            data = data[: data.rfind(b"\n") + 1]
+            self._index_size += len(data)
+            for line in data.splitlines():
+                game_id, offset, length = map(int, line.split())
+                if offset < 0:
+                    self._index.pop(game_id, None)
+                else:
+                    self._index[game_id] = (offset, length)
+
+    def __contains__(self, game_id: int) -> bool:
+        self._refresh()
+        return game_id in self._index
+
+    def game_ids(self) -> Iterator[int]:
+        self._refresh()
+        yield from list(self._index)
+
+    def add(self, game_id: int, game: Game) -> None:
+        member = gzip.compress(game_record(game_id, game))
+        with open(self.path, "ab") as f:
+            # appends of other processes are serialized
+            fcntl.flock(f, fcntl.LOCK_EX)
+            offset = f.seek(0, os.SEEK_END)
+            f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+            self._append_index(game_id, offset, len(member))
+
+    def remove(self, game_id: int) -> None:
+        with open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self._append_index(game_id, -1, 0)
+
+    def _append_index(self, game_id: int, offset: int, length: int) -> None:
+        with open(self.index_path, "ab") as f:
+            f.write(b"%d %d %d\n" % (game_id, offset, length))
+
+    def load(self, game_id: int) -> Game:
+        self._refresh()
+        if game_id not in self._index:
+            raise FileNotFoundError(f"Game {game_id} not in {self.path}")
+        offset, length = self._index[game_id]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return parse_record(gzip.decompress(f.read(length)))[1]
+
+
+class ArchivingStorage(Storage):
+    """Moves the games idle for more than ttl out of a storage, to an archive.
+
+    Archived games are put back in the storage when loaded. A game is not
+    archived while held by a session store of this process or locked, nor
+    when it changes meanwhile. ttl is meant to be much longer than the
+    session store TTL, so that archived games are no longer in memory.
+
+    Every interval, a thread of its own, started by maintain, archives the
+    idle games, so that the flushes of the session stores do not wait.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        archive_path: Optional[str] = None,
+        ttl: float = ARCHIVE_TTL,
+        interval: float = ARCHIVE_INTERVAL,
+    ):
+        super().__init__(storage.file_dir)
+        self.storage = storage
+        self.archive = GameArchive(
+            archive_path or os.path.join(storage.file_dir, ARCHIVE_NAME)
+        )
+        self.ttl = ttl
+        self.interval = interval
+        self._archiver: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def exists(self, game_id: int) -> bool:
+        return self.storage.exists(game_id) or game_id in self.archive
+
+    def load(self, game_id: int) -> Game:
+        if self.storage.exists(game_id) or game_id not in self.archive:
+            return self.storage.load(game_id)
+        game = self.archive.load(game_id)
+        self.storage.save(game_id, game)
+        self.archive.remove(game_id)
+        logger.info(f"Restored game {game_id} from the archive")
+        return game
+
+    def save(self, game_id: int, game: Game) -> None:
+        self.storage.save(game_id, game)
+
+    def append(self, game_id: int, game: Game, record: Dict) -> bool:
+        return self.storage.append(game_id, game, record)
+
+    def delete(self, game_id: int) -> None:
+        self.storage.delete(game_id)
+        if game_id in self.archive:
+            self.archive.remove(game_id)
+
+    def new_id(self) -> int:
+        return self.storage.new_id()
+
+    def game_ids(self) -> Iterator[int]:
+        # live games, then archived ones
+        yield from self.storage.game_ids()
+        for game_id in self.archive.game_ids():
+            if not self.storage.exists(game_id):
+                yield game_id
+
+    def revision(self, game_id: int) -> int:
+        return self.storage.revision(game_id)
+
+    def list_games(
+        self,
+        limit: int = LIST_LIMIT,
+        before: Optional[float] = None,
+        before_id: Optional[int] = None,
+    ) -> List[GameInfo]:
+        # live games only
+        return self.storage.list_games(limit, before, before_id)
+
+    def maintain(self) -> None:
+        if self._archiver is None:
+            self._archiver = threading.Thread(
+                target=self._archive_loop, daemon=True
+            )
+            self._archiver.start()
+
+    def stop(self) -> None:
+        # stops the archiver, waiting for the games being archived
+        self._stopped.set()
+        if self._archiver is not None:
+            self._archiver.join()
+
+    def _archive_loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.archive_idle()
+            except Exception:
+                logger.exception("Failed to archive idle games")
+
+    def archive_idle(self) -> int:
+        before: Optional[float] = time.time() - self.ttl
+        before_id: Optional[int] = None
+        count = 0
+        while True:
+            infos = self.storage.list_games(ARCHIVE_BATCH, before, before_id)
+            if not infos:
+                return count
+            for info in infos:
+                count += self._archive_game(info.id)
+            before, before_id = infos[-1].updated_at, infos[-1].id
+
+    def _archive_game(self, game_id: int) -> bool:
+        # games in memory are not idle, whatever their storage says: their
+        # changes can still be on their way, e.g. as action log records
+        if is_resident(self, game_id):
+            return False
+        fd = self.try_lock(game_id)
+        if fd is None:
+            return False
+        try:
+            revision = self.storage.revision(game_id)
+            self.archive.add(game_id, self.storage.load(game_id))
+            if self.storage.revision(game_id) != revision or is_resident(
+                self, game_id
+            ):
+                # changed or loaded meanwhile
+                self.archive.remove(game_id)
+                return False
+            self.storage.delete(game_id)
+            return True
+        finally:
+            self.unlock(fd)
+
+
+def archiving_storage(
+    storage_factory: Callable[[str], Storage],
+    file_dir: str = GAMES_DIR,
+    ttl: float = ARCHIVE_TTL,
+) -> ArchivingStorage:
+    # storage factory, picklable when bound with functools.partial
+    return ArchivingStorage(storage_factory(file_dir), ttl=ttl)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the stored games to an archive, or import them"
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("archive", help="gzip compressed json lines")
+    parser.add_argument("--dir", default=GAMES_DIR, help="games directory")
+    parser.add_argument("--storage", choices=list(STORAGES), default="file")
+    args = parser.parse_args()
+    storage = STORAGES[args.storage](args.dir)
+    start = time.perf_counter()
+    if args.command == "export":
+        count = export_games(storage, args.archive)
+    else:
+        count = import_games(storage, args.archive)
+    print(
+        f"{args.command}ed {count} games in "
+        f"{time.perf_counter() - start:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
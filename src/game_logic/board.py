@@ -1,9 +1,24 @@
+import base64
+import struct
 from enum import Enum
-from typing import List
-
-from pydantic import BaseModel, ValidationError, model_validator
-
-from src.game_logic.terrain_generation.perlin_noise import generate_world
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from pydantic import (
+    BaseModel,
+    GetCoreSchemaHandler,
+    SerializationInfo,
+    model_serializer,
+    model_validator,
+)
+from pydantic_core import core_schema
+
+from src.game_logic.terrain_generation.perlin_noise import (
+    OCTAVES,
+    THRESHOLDS,
+    generate_world,
+)
 
 
 class CellType(Enum):
@@ -15,6 +30,16 @@ class CellType(Enum):
     city = "city"
 
 
+# byte code of each cell type in the packed board, new types must be added
+# at the end to keep old boards readable
+CELL_TYPE_CODES = list(CellType)
+CELL_CODE_FROM_TYPE = {type: code for code, type in enumerate(CELL_TYPE_CODES)}
+
+# radius of the board, followed by one byte per cell for the type and one
+# byte per cell for the yields
+PACKED_HEADER = struct.Struct("<H")
+
+
 class Cell(BaseModel):
     type: CellType
     yields: int
@@ -62,77 +87,298 @@ class Board(BaseModel):
         return 0 <= coord.col < self.width and 0 <= coord.row < self.height"""
 
 
-class HexCoord(BaseModel):
+class HexCoord(NamedTuple):
+    # plain tuple, so that coordinates are cheap to build and can be used as
+    # dict keys. The q + r + s == 0 check runs when validated by pydantic
+    # (e.g. from the api), not when built directly in the code.
     q: int
     r: int
     s: int
 
-    @model_validator(mode="after")
-    def valid_params(self):
-        if self.q + self.r + self.s != 0:
-            raise ValidationError(
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls, source: Any, handler: GetCoreSchemaHandler
+    ) -> core_schema.CoreSchema:
+        from_dict = core_schema.no_info_after_validator_function(
+            cls._from_dict,
+            core_schema.typed_dict_schema(
+                {
+                    axis: core_schema.typed_dict_field(
+                        core_schema.int_schema()
+                    )
+                    for axis in ["q", "r", "s"]
+                }
+            ),
+        )
+        return core_schema.json_or_python_schema(
+            json_schema=from_dict,
+            python_schema=core_schema.union_schema(
+                [core_schema.is_instance_schema(cls), from_dict]
+            ),
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                cls.model_dump
+            ),
+        )
+
+    @classmethod
+    def _from_dict(cls, data: Dict[str, int]) -> "HexCoord":
+        coord = cls(q=data["q"], r=data["r"], s=data["s"])
+        if coord.q + coord.r + coord.s != 0:
+            raise ValueError(
                 "q,r,s coords must sum to 0."
-                f"Sum to {self.q + self.r + self.s} instead"
+                f"Sum to {coord.q + coord.r + coord.s} instead"
             )
-        return self
+        return coord
 
-    def distance(self, to: "HexCoord") -> int:
-        return max(
-            [abs(self.q - to.q), abs(self.r - to.r), abs(self.s - to.s)]
-        )
+    def model_dump(self, mode: str = "python") -> Dict[str, int]:
+        # same output as the former pydantic model
+        return {"q": self.q, "r": self.r, "s": self.s}
 
-    def __eq__(self, __value: object) -> bool:
-        assert isinstance(__value, HexCoord)
+    def distance(self, to: "HexCoord") -> int:
         return (
-            self.q == __value.q and self.r == __value.r and self.s == __value.s
+            abs(self.q - to.q) + abs(self.r - to.r) + abs(self.s - to.s)
+        ) // 2
+
+    def neighbors(self) -> Iterator["HexCoord"]:
+        q, r, s = self
+        for dq, dr, ds in HEX_DIRECTIONS:
+            yield HexCoord(q + dq, r + dr, s + ds)
+
+    def ring(self, radius: int) -> Iterator["HexCoord"]:
+        # cells at exactly `radius` steps, walking around the ring
+        if radius == 0:
+            yield self
+            return
+        dq, dr, ds = HEX_DIRECTIONS[4]
+        q, r, s = (
+            self.q + dq * radius,
+            self.r + dr * radius,
+            self.s + ds * radius,
         )
+        for dq, dr, ds in HEX_DIRECTIONS:
+            for _ in range(radius):
+                yield HexCoord(q, r, s)
+                q, r, s = q + dq, r + dr, s + ds
+
+    def range(self, radius: int) -> Iterator["HexCoord"]:
+        # cells within `radius` steps, self included
+        for dq in range(-radius, radius + 1):
+            for dr in range(
+                max(-radius, -dq - radius), min(radius, radius - dq) + 1
+            ):
+                yield HexCoord(self.q + dq, self.r + dr, self.s - dq - dr)
+
+
+HEX_DIRECTIONS = (
+    HexCoord(1, 0, -1),
+    HexCoord(1, -1, 0),
+    HexCoord(0, -1, 1),
+    HexCoord(-1, 0, 1),
+    HexCoord(-1, 1, 0),
+    HexCoord(0, 1, -1),
+)
 
 
 class HexBoard(BaseModel):
-    raw_board: List[List[Cell]]
+    # cells are stored row major by (q, r) in two flat arrays, one byte per
+    # cell for the CellType code and one for the yields
     radius: int
+    cell_types: bytes
+    cell_yields: bytes
+
+    @model_validator(mode="before")
+    @classmethod
+    def unpack(cls, data: Any) -> Any:
+        if isinstance(data, dict) and "packed" in data:
+            board = HexBoard.from_bytes(base64.b64decode(data["packed"]))
+            return {
+                "radius": board.radius,
+                "cell_types": board.cell_types,
+                "cell_yields": board.cell_yields,
+            }
+        if isinstance(data, dict) and "raw_board" in data:
+            return HexBoard.from_raw_board(data["radius"], data["raw_board"])
+        return data
 
-    def __eq__(self, __value: object) -> bool:
-        assert isinstance(__value, HexBoard)
-        return self.raw_board == __value.raw_board
+    @model_validator(mode="after")
+    def valid_size(self):
+        n_cells = self.side_size * self.side_size
+        if len(self.cell_types) != n_cells or len(self.cell_yields) != n_cells:
+            raise ValueError(
+                f"Board of radius {self.radius} must have {n_cells} cells"
+            )
+        return self
+
+    @model_serializer
+    def serialize(self, info: SerializationInfo) -> Dict[str, Any]:
+        # same shape as the former raw_board representation
+        cells = [
+            {"type": type.value if info.mode_is_json() else type, "yields": y}
+            for type, y in zip(
+                (CELL_TYPE_CODES[code] for code in self.cell_types),
+                self.cell_yields,
+            )
+        ]
+        side_size = self.side_size
+        return {
+            "raw_board": [
+                cells[start:end]
+                for start, end in zip(
+                    range(0, len(cells), side_size),
+                    range(side_size, len(cells) + 1, side_size),
+                )
+            ],
+            "radius": self.radius,
+        }
 
     @staticmethod
-    def build_circular(radius: int) -> "HexBoard":
+    def from_raw_board(radius: int, raw_board: List[List[Any]]) -> Dict:
+        cells = [
+            cell if isinstance(cell, Cell) else Cell(**cell)
+            for row in raw_board
+            for cell in row
+        ]
+        try:
+            cell_yields = bytes(cell.yields for cell in cells)
+        except ValueError:
+            raise ValueError("Cell yields must be between 0 and 255")
+        return {
+            "radius": radius,
+            "cell_types": bytes(
+                CELL_CODE_FROM_TYPE[cell.type] for cell in cells
+            ),
+            "cell_yields": cell_yields,
+        }
+
+    def to_bytes(self) -> bytes:
+        return (
+            PACKED_HEADER.pack(self.radius)
+            + self.cell_types
+            + self.cell_yields
+        )
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "HexBoard":
+        if len(data) < PACKED_HEADER.size:
+            raise ValueError(
+                "Packed board shorter than its header, "
+                f"{PACKED_HEADER.size} bytes"
+            )
+        (radius,) = PACKED_HEADER.unpack_from(data)
         side_size = (2 * radius) + 1
+        n_cells = side_size * side_size
+        if len(data) != PACKED_HEADER.size + 2 * n_cells:
+            raise ValueError(
+                f"Packed board of radius {radius} must be "
+                f"{PACKED_HEADER.size + 2 * n_cells} bytes long"
+            )
+        types_start = PACKED_HEADER.size
+        yields_start = types_start + n_cells
+        cell_types = data[types_start:yields_start]
+        if max(cell_types) >= len(CELL_TYPE_CODES):
+            raise ValueError(f"Unknown cell type code {max(cell_types)}")
+        return HexBoard.model_construct(
+            radius=radius,
+            cell_types=bytes(cell_types),
+            cell_yields=bytes(data[yields_start:]),
+        )
 
-        type_from_idx = [
-            CellType.see,
-            CellType.plain,
-            CellType.hills,
-            CellType.mauntain,
-        ]
+    def to_packed_dict(self) -> Dict:
+        # json compatible alternative to model_dump, accepted by the model
+        return {
+            "radius": self.radius,
+            "packed": base64.b64encode(self.to_bytes()).decode("ascii"),
+        }
+
+    def __eq__(self, __value: object) -> bool:
+        assert isinstance(__value, HexBoard)
+        return (
+            self.radius == __value.radius
+            and self.cell_types == __value.cell_types
+            and self.cell_yields == __value.cell_yields
+        )
+
+    @property
+    def side_size(self) -> int:
+        return (2 * self.radius) + 1
 
-        board_idxs = generate_world(side_size, side_size)
-        raw_board = [
-            [Cell(type=type_from_idx[idx], yields=1) for idx in row]
-            for row in board_idxs
+    @property
+    def raw_board(self) -> List[List[Cell]]:
+        side_size = self.side_size
+        return [
+            [
+                _cell(self.cell_types[idx], self.cell_yields[idx])
+                for idx in range(row * side_size, (row + 1) * side_size)
+            ]
+            for row in range(side_size)
         ]
 
-        # crop corners
-        for row in range(radius):
-            for i in range(radius - row):
-                raw_board[row][i] = Cell(type=CellType.empty, yields=0)
-                raw_board[side_size - 1 - row][side_size - 1 - i] = Cell(
-                    type=CellType.empty, yields=0
-                )
+    @staticmethod
+    def build_circular(
+        radius: int,
+        seed: Optional[int] = None,
+        octaves: float = OCTAVES,
+        thresholds: List[float] = THRESHOLDS,
+    ) -> "HexBoard":
+        side_size = (2 * radius) + 1
 
-        return HexBoard(radius=radius, raw_board=raw_board)
+        type_from_idx = np.array(
+            [
+                CELL_CODE_FROM_TYPE[CellType.see],
+                CELL_CODE_FROM_TYPE[CellType.plain],
+                CELL_CODE_FROM_TYPE[CellType.hills],
+                CELL_CODE_FROM_TYPE[CellType.mauntain],
+            ],
+            dtype=np.uint8,
+        )
+        if len(thresholds) != len(type_from_idx) - 1:
+            raise ValueError(
+                f"{len(type_from_idx) - 1} thresholds are needed, "
+                f"got {len(thresholds)}"
+            )
+
+        board_idxs = generate_world(
+            side_size,
+            side_size,
+            seed=seed,
+            octaves=octaves,
+            thresholds=thresholds,
+        )
+        cell_types = type_from_idx[board_idxs]
+        cell_yields = np.ones((side_size, side_size), dtype=np.uint8)
+
+        # crop corners, cells with |q + r| > radius
+        axis = np.arange(side_size)
+        outside = np.abs(np.add.outer(axis, axis) - 2 * radius) > radius
+        cell_types[outside] = CELL_CODE_FROM_TYPE[CellType.empty]
+        cell_yields[outside] = 0
+
+        return HexBoard.model_construct(
+            radius=radius,
+            cell_types=cell_types.tobytes(),
+            cell_yields=cell_yields.tobytes(),
+        )
 
     def valid_coord(self, coord: HexCoord) -> bool:
-        for axis in [coord.q, coord.r, coord.s]:
-            if abs(axis) > self.radius:
-                return False
-        return True
+        radius = self.radius
+        return (
+            -radius <= coord.q <= radius
+            and -radius <= coord.r <= radius
+            and -radius <= coord.s <= radius
+        )
 
     def get_cell(self, coord: HexCoord) -> Cell:
         if not self.valid_coord(coord):
             raise OutOfBoardException()
-        return self.raw_board[coord.q + self.radius][coord.r + self.radius]
+        idx = (coord.q + self.radius) * self.side_size + coord.r + self.radius
+        return _cell(self.cell_types[idx], self.cell_yields[idx])
+
+
+@lru_cache(maxsize=None)
+def _cell(type_code: int, yields: int) -> Cell:
+    # cells are never modified, so a single instance is shared by all the
+    # cells with the same content
+    return Cell(type=CELL_TYPE_CODES[type_code], yields=yields)
 
 
 class OutOfBoardException(Exception):
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from random import getrandbits
+from typing import Deque, Dict, List, Optional, Tuple
+
+from src.game_logic.board import HexBoard
+from src.game_logic.terrain_generation.perlin_noise import OCTAVES, THRESHOLDS
+
+logger = logging.getLogger(__name__)
+
+BOARDS_DIR = "data/boards"
+MAX_BOARDS = 64
+MAX_FILES = 1024
+WARM_RADII = [5, 10, 15, 20]
+POOL_SIZE = 4
+
+BoardKey = Tuple[int, int, float, Tuple[float, ...]]
+
+
+class BoardCache:
+    """Bounded cache of generated boards, in memory and on disk.
+
+    Boards are keyed by (radius, seed, octaves, thresholds). They are never
+    modified, so the same instance is shared by all the games using it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = BOARDS_DIR,
+        max_boards: int = MAX_BOARDS,
+        max_files: int = MAX_FILES,
+    ):
+        self.cache_dir = cache_dir
+        self.max_boards = max_boards
+        self.max_files = max_files
+        self._boards: OrderedDict[BoardKey, HexBoard] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, key: BoardKey) -> str:
+        radius, seed, octaves, thresholds = key
+        thresholds_str = "_".join(str(th) for th in thresholds)
+        return os.path.join(
+            self.cache_dir, f"{radius}_{seed}_{octaves}_{thresholds_str}.bin"
+        )
+
+    def get(
+        self,
+        radius: int,
+        seed: int,
+        octaves: float = OCTAVES,
+        thresholds: List[float] = THRESHOLDS,
+    ) -> HexBoard:
+        key = (radius, seed, octaves, tuple(thresholds))
+        with self._lock:
+            board = self._boards.get(key)
+            if board is not None:
+                self._boards.move_to_end(key)
+                return board
+
+        board = self._load(key)
+        if board is None:
+            board = HexBoard.build_circular(
+                radius, seed=seed, octaves=octaves, thresholds=thresholds
+            )
+            self._save(key, board)
+
+        with self._lock:
+            self._boards[key] = board
+            while len(self._boards) > self.max_boards:
+                self._boards.popitem(last=False)
+        return board
+
+    def _load(self, key: BoardKey) -> Optional[HexBoard]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                return HexBoard.from_bytes(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning(f"Ignoring corrupted cached board {key}")
+            return None
+
+    def _save(self, key: BoardKey, board: HexBoard) -> None:
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_filename = f"{self.path(key)}.tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(board.to_bytes())
+        os.replace(tmp_filename, self.path(key))
+
+        # keep the most recently written files only
+        file_paths = [
+            os.path.join(self.cache_dir, file_path)
+            for file_path in os.listdir(self.cache_dir)
+            if file_path.endswith(".bin")
+        ]
+        if len(file_paths) > self.max_files:
+            file_paths.sort(key=os.path.getmtime)
+            for file_path in file_paths[: len(file_paths) - self.max_files]:
+                os.remove(file_path)
+
+
+class BoardPool:
+    """Keeps freshly generated random boards ready for common radii.
+
+    A background thread refills the pool as boards are taken, so that
+    creating a game does not wait for the terrain generation.
+    """
+
+    def __init__(
+        self, radii: List[int] = WARM_RADII, pool_size: int = POOL_SIZE
+    ):
+        self.radii = radii
+        self.pool_size = pool_size
+        self._pools: Dict[int, Deque[HexBoard]] = {
+            radius: deque() for radius in radii
+        }
+        self._taken = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def take(self, radius: int) -> HexBoard:
+        pool = self._pools.get(radius)
+        if pool:
+            try:
+                board = pool.popleft()
+                self._taken.set()
+                return board
+            except IndexError:
+                pass
+        return HexBoard.build_circular(radius, seed=getrandbits(32))
+
+    def fill(self) -> None:
+        for radius, pool in self._pools.items():
+            while len(pool) < self.pool_size and not self._stopped.is_set():
+                pool.append(
+                    HexBoard.build_circular(radius, seed=getrandbits(32))
+                )
+
+    def _fill_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._taken.clear()
+            try:
+                self.fill()
+            except Exception:
+                logger.exception("Failed to generate pooled boards")
+            self._taken.wait()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._fill_loop, daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._taken.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+board_cache = BoardCache()
+board_pool = BoardPool()
+
+
+def get_board(radius: int, seed: Optional[int] = None) -> HexBoard:
+    # seeded boards are reproducible and cached, the others are fresh random
+    # ones from the pool
+    if seed is None:
+        return board_pool.take(radius)
+    return board_cache.get(radius, seed)
@@ -1,7 +1,9 @@
-from pydantic import BaseModel, field_validator, ValidationError
+from typing import List, Set
+
+from pydantic import BaseModel, PrivateAttr, field_validator
+
 from src.game_logic.board import HexCoord
 from src.game_logic.units import Worker
-from typing import List
 
 
 class City(BaseModel):
@@ -12,6 +14,8 @@ class City(BaseModel):
     workers: List[Worker]
     actions: int = 0
 
+    _worker_locations: Set[HexCoord] = PrivateAttr()
+
     def __eq__(self, __value: object) -> bool:
         assert isinstance(__value, City)
         if self.id != __value.id:
@@ -30,38 +34,47 @@ class City(BaseModel):
 
     @field_validator("workers")
     def workers_close_to_city(cls, v: List[Worker], values):
+        # the workers and the city form a single connected group, walked
+        # from the city through the adjacent workers
         if not v:
             return v
-        visited = [False] * len(v)
-
-        search([w.location for w in v], visited, 0)
-
-        # graph is connected
-        for is_vis in visited:
-            assert is_vis
-
-        # graph is close to the city
-        for pos in v:
-            if pos.location.distance(values.data["location"]) <= 1:
-                break
-        else:
-            raise ValidationError("Workers dont connect to the city")
-
+        locations = {worker.location for worker in v}
+        stack = [
+            location
+            for location in values.data["location"].range(1)
+            if location in locations
+        ]
+        if not stack:
+            raise ValueError("Workers dont connect to the city")
+        connected = set(stack)
+        while stack:
+            for location in stack.pop().neighbors():
+                if location in locations and location not in connected:
+                    connected.add(location)
+                    stack.append(location)
+        if len(connected) < len(locations):
+            raise ValueError("Workers must be connected to each other")
         return v
 
+    def model_post_init(self, __context) -> None:
+        self._worker_locations = {worker.location for worker in self.workers}
+
     def is_worker_location_valid(self, location: HexCoord) -> bool:
+        # next to the city or to one of its workers, which keeps the workers
+        # connected when adding one
         if location.distance(self.location) <= 1:
             return True
-        for worker in self.workers:
-            if location.distance(worker.location) <= 1:
-                return True
-        return False
+        worker_locations = self._worker_locations
+        return any(
+            neighbor in worker_locations for neighbor in location.neighbors()
+        )
 
+    def clone(self) -> "City":
+        # copy that can get new workers without changing this city
+        city = self.model_copy(update={"workers": list(self.workers)})
+        city._worker_locations = set(self._worker_locations)
+        return city
 
-def search(nodes: List[HexCoord], visited: List[bool], idx: int):
-    if visited[idx]:
-        return
-    visited[idx] = True
-    for j in range(len(nodes)):
-        if nodes[j].distance(nodes[idx]) <= 1:
-            search(nodes, visited, j)
+    def add_worker(self, worker: Worker) -> None:
+        self.workers.append(worker)
+        self._worker_locations.add(worker.location)
@@ -0,0 +1,168 @@
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel
+
+from src.game_logic.city import City
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.serialization import get_serializer
+from src.game_logic.units import Unit
+
+MAX_DELTAS = 256
+
+
+class GameDelta(BaseModel):
+    # changes bringing a game from from_version to version. Units, cities and
+    # players are listed in full when added or changed
+    from_version: int
+    version: int
+    current_player_idx: int
+    units: List[Unit] = []
+    removed_unit_ids: List[int] = []
+    cities: List[City] = []
+    players: List[Player] = []
+
+
+class GameState(NamedTuple):
+    # what can change in each unit, city and player, by id
+    units: Dict[int, Tuple[Any, ...]]
+    cities: Dict[int, Tuple[Any, ...]]
+    players: Dict[int, Tuple[Any, ...]]
+
+
+def game_state(game: Game) -> GameState:
+    return GameState(
+        units={
+            unit.id: (unit.location, unit.owner_id, unit.type, unit.actions)
+            for unit in game.units
+        },
+        cities={
+            city.id: (
+                city.location,
+                city.owner_id,
+                city.name,
+                len(city.workers),
+                city.actions,
+            )
+            for city in game.cities
+        },
+        players={
+            player.id: (player.budget, player.worker_to_place)
+            for player in game.players
+        },
+    )
+
+
+def game_delta(game: Game, before: GameState, from_version: int) -> GameDelta:
+    # changes since the state taken at from_version
+    after = game_state(game)
+    return GameDelta(
+        from_version=from_version,
+        version=game.version,
+        current_player_idx=game.current_player_idx,
+        units=[
+            unit
+            for unit in game.units
+            if before.units.get(unit.id) != after.units[unit.id]
+        ],
+        removed_unit_ids=[
+            unit_id for unit_id in before.units if unit_id not in after.units
+        ],
+        cities=[
+            city
+            for city in game.cities
+            if before.cities.get(city.id) != after.cities[city.id]
+        ],
+        players=[
+            player
+            for player in game.players
+            if before.players.get(player.id) != after.players[player.id]
+        ],
+    )
+
+
+def merge_deltas(deltas: List[GameDelta]) -> GameDelta:
+    # one delta with the changes of consecutive deltas
+    units: Dict[int, Unit] = {}
+    removed_unit_ids: Dict[int, None] = {}
+    cities: Dict[int, City] = {}
+    players: Dict[int, Player] = {}
+    for delta in deltas:
+        for unit in delta.units:
+            units[unit.id] = unit
+            removed_unit_ids.pop(unit.id, None)
+        for unit_id in delta.removed_unit_ids:
+            units.pop(unit_id, None)
+            removed_unit_ids[unit_id] = None
+        cities.update((city.id, city) for city in delta.cities)
+        players.update((player.id, player) for player in delta.players)
+    return GameDelta.model_construct(
+        from_version=deltas[0].from_version,
+        version=deltas[-1].version,
+        current_player_idx=deltas[-1].current_player_idx,
+        units=list(units.values()),
+        removed_unit_ids=list(removed_unit_ids),
+        cities=list(cities.values()),
+        players=list(players.values()),
+    )
+
+
+class DeltaHistory:
+    """Latest deltas of a game, to bring clients up to date.
+
+    The deltas refer to the live units, cities and players, which is fine
+    as merged deltas always bring the client to the current version.
+    """
+
+    def __init__(self, max_deltas: int = MAX_DELTAS):
+        self._deltas: Deque[GameDelta] = deque(maxlen=max_deltas)
+
+    def append(self, delta: GameDelta) -> None:
+        if self._deltas and self._deltas[-1].version != delta.from_version:
+            # changed in some other way, the old deltas cannot be chained
+            self._deltas.clear()
+        self._deltas.append(delta)
+
+    def since(self, game: Game, version: int) -> Optional[GameDelta]:
+        # None when the history does not go back to version
+        if version == game.version:
+            return GameDelta(
+                from_version=version,
+                version=version,
+                current_player_idx=game.current_player_idx,
+            )
+        if not self._deltas or self._deltas[-1].version != game.version:
+            return None
+        deltas = [delta for delta in self._deltas if delta.version > version]
+        if not deltas or deltas[0].from_version != version:
+            return None
+        return merge_deltas(deltas)
+
+
+def delta_history(game: Game) -> DeltaHistory:
+    history = _histories.get(id(game))
+    if history is None:
+        history = DeltaHistory()
+        _histories[id(game)] = history
+        weakref.finalize(game, _histories.pop, id(game), None)
+    return history
+
+
+def game_json(
+    game: Game, packed_board: bool = False, since_version: Optional[int] = None
+) -> bytes:
+    # GET /game response: only the changes since since_version if they are
+    # still known, the full game otherwise
+    if since_version is not None:
+        delta = delta_history(game).since(game, since_version)
+        if delta is not None:
+            return get_serializer().dumps(delta)
+    if packed_board:
+        # board sent as {"radius": ..., "packed": <base64>}
+        return game.to_packed_json()
+    return get_serializer().dumps(game)
+
+
+_histories: Dict[int, DeltaHistory] = {}
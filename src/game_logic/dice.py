@@ -1,23 +1,36 @@
 import logging
-from random import randint
-from typing import List
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
+import numpy as np
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
+# used when no generator is given, games pass their own one
+default_rng = np.random.default_rng()
+
 
 class Dice(BaseModel):
     dice_size: int
 
-    def roll(self) -> int:
-        r = randint(1, self.dice_size)
-        logger.info(f"dice of size {self.dice_size} rolled {r}")
+    def roll(self, rng: Optional[np.random.Generator] = None) -> int:
+        if self.dice_size == 0:
+            return 0
+        # a scalar integers() call is several times slower than random()
+        r = 1 + int((rng or default_rng).random() * self.dice_size)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("dice of size %s rolled %s", self.dice_size, r)
         return r
 
     def expected(self) -> float:
+        if self.dice_size == 0:
+            return 0.0
         return (self.dice_size + 1) / 2
 
+    def distribution(self) -> np.ndarray:
+        return sum_distribution((self.dice_size,))
+
     def __eq__(self, __value: object) -> bool:
         assert isinstance(__value, Dice)
         return self.dice_size == __value.dice_size
@@ -26,18 +39,40 @@ class Dice(BaseModel):
 class DiceSet(BaseModel):
     dices: List[Dice]
 
-    def roll(self) -> int:
+    def roll(self, rng: Optional[np.random.Generator] = None) -> int:
         out = 0
         for dice in self.dices:
-            out += dice.roll()
+            out += dice.roll(rng)
         return out
 
+    def roll_many(
+        self, n: int, rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+        # totals of n independent rolls of the whole set
+        dice_sizes = np.array(
+            [size for size in self.dice_sizes if size > 0], dtype=np.int64
+        )
+        if len(dice_sizes) == 0:
+            return np.zeros(n, dtype=np.int64)
+        rolls = (rng or default_rng).integers(
+            1, dice_sizes, size=(n, len(dice_sizes)), endpoint=True
+        )
+        return rolls.sum(axis=1)
+
     def expected(self) -> float:
         out = 0.0
         for dice in self.dices:
             out += dice.expected()
         return out
 
+    @property
+    def dice_sizes(self) -> Tuple[int, ...]:
+        return tuple(sorted(dice.dice_size for dice in self.dices))
+
+    def distribution(self) -> np.ndarray:
+        # probability of each total, indexed by the total
+        return sum_distribution(self.dice_sizes)
+
     def __eq__(self, __value: object) -> bool:
         assert isinstance(__value, DiceSet)
         return self.dices == __value.dices
@@ -59,3 +94,29 @@ class DiceSet(BaseModel):
             for _ in range(n_dice):
                 dices.append(Dice(dice_size=dice_size))
         return DiceSet(dices=dices)
+
+
+@lru_cache(maxsize=None)
+def sum_distribution(dice_sizes: Tuple[int, ...]) -> np.ndarray:
+    # Probability of each total rolled by the dice, indexed by the total.
+    # Pass the sizes sorted, so that sets sharing the smallest dice share
+    # the cached partial convolutions. The array is shared, do not modify.
+    if not dice_sizes:
+        distribution = np.ones(1)
+    elif dice_sizes[-1] == 0:
+        # a d0 always rolls 0
+        distribution = sum_distribution(dice_sizes[:-1])
+    else:
+        single = np.full(dice_sizes[-1] + 1, 1 / dice_sizes[-1])
+        single[0] = 0
+        distribution = np.convolve(sum_distribution(dice_sizes[:-1]), single)
+    distribution.setflags(write=False)
+    return distribution
+
+
+def win_probability(attack: np.ndarray, defense: np.ndarray) -> float:
+    # probability that a roll from the attack distribution is strictly
+    # greater than one from the defense distribution
+    attack_at_most = np.cumsum(attack)
+    n = min(len(attack), len(defense))
+    return float(np.dot(defense[:n], 1 - attack_at_most[:n]))
@@ -1,2 +1,15 @@
 class IllegalActionException(Exception):
+    # reason names the rule broken, e.g. "not_owner", for the metrics; the
+    # message has the details
+    def __init__(self, message: str = "", reason: str = "other"):
+        super().__init__(message)
+        self.reason = reason
+
+    def __reduce__(self):
+        # keeps the reason across processes
+        return type(self), (str(self), self.reason)
+
+
+class GameConflictException(Exception):
+    # the game changed, or is busy in another worker: the client can retry
     pass
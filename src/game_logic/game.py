@@ -1,17 +1,29 @@
-import json
+import base64
 import logging
-from os import listdir
-from typing import List, Optional
+from random import getrandbits
+from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar
 
-from pydantic import BaseModel, ValidationError, field_validator
+import numpy as np
+from pydantic import (
+    BaseModel,
+    Field,
+    PrivateAttr,
+    ValidationError,
+    field_validator,
+)
 
 from src.game_logic.board import HexBoard, HexCoord
 from src.game_logic.city import City
+from src.game_logic.exceptions import IllegalActionException
+from src.game_logic.pathfinding import distance_field
 from src.game_logic.player import Player
-from src.game_logic.units import Unit
+from src.game_logic.serialization import get_serializer
+from src.game_logic.units import Unit, UnitType, Worker
 
 logger = logging.getLogger()
 
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
 
 class Game(BaseModel):
     board: HexBoard
@@ -19,6 +31,20 @@ class Game(BaseModel):
     units: List[Unit]
     cities: List[City]
     current_player_idx: int
+    # number of actions applied to the game
+    version: int = 0
+    # dice generator, kept out of the api responses so that players cannot
+    # predict the rolls
+    seed: Optional[int] = Field(default=None, exclude=True)
+    rng_state: Optional[Dict[str, Any]] = Field(default=None, exclude=True)
+
+    _units_by_id: Dict[int, Unit] = PrivateAttr()
+    _units_by_location: Dict[HexCoord, Unit] = PrivateAttr()
+    _cities_by_id: Dict[int, City] = PrivateAttr()
+    _players_by_id: Dict[int, Player] = PrivateAttr()
+    _workers_by_location: Dict[HexCoord, Worker] = PrivateAttr()
+    _rng: np.random.Generator = PrivateAttr()
+    _distance_fields: Dict[Tuple, Dict[HexCoord, int]] = PrivateAttr()
 
     @field_validator("players")
     def players_unique_id(cls, v):
@@ -49,8 +75,7 @@ class Game(BaseModel):
 
     @field_validator("cities")
     def workers_unique_id(cls, v):
-        print(v)
-        workers_ids = sum([[w.id for w in city.workers] for city in v], [])
+        workers_ids = [w.id for city in v for w in city.workers]
         if len(workers_ids) > len(set(workers_ids)):
             raise ValidationError(
                 "Game model corrupted: Workers ids must be unique"
@@ -82,62 +107,263 @@ class Game(BaseModel):
             and self.current_player_idx == __value.current_player_idx
         )
 
+    def to_packed_dict(self, include_rng: bool = False) -> Dict:
+        # same as model_dump(mode="json"), with the board packed. The dice
+        # generator is included for storage only
+        game_dict = self.model_dump(mode="json", exclude={"board"})
+        game_dict.update(self._packed_extras(include_rng))
+        return game_dict
+
+    def to_packed_json(self, include_rng: bool = False) -> bytes:
+        # same as to_packed_dict, serialized without building the dict
+        extras = get_serializer().dumps_data(self._packed_extras(include_rng))
+        game_json = self.model_dump_json(exclude={"board"}).encode()
+        return extras[:-1] + b"," + game_json[1:]
+
+    def _packed_extras(self, include_rng: bool) -> Dict[str, Any]:
+        extras: Dict[str, Any] = {"board": self.board.to_packed_dict()}
+        if include_rng:
+            # the 128 bit state does not fit json numbers of most parsers
+            state = self._rng.bit_generator.state
+            extras["seed"] = self.seed
+            extras["rng_state"] = {
+                **state,
+                "state": {k: str(v) for k, v in state["state"].items()},
+            }
+        return extras
+
+    @staticmethod
+    def from_trusted_dict(game_dict: Dict[str, Any]) -> "Game":
+        # Builds the game from a json dump without running the validators,
+        # for games we wrote ourselves (model_dump or to_packed_dict).
+        # Anything else goes through Game(**game_dict).
+        return Game.model_construct(
+            board=_board_from_dict(game_dict["board"]),
+            players=[
+                Player.model_construct(**player)
+                for player in game_dict["players"]
+            ],
+            units=[
+                _construct(
+                    Unit,
+                    {
+                        "location": _coord_from_dict(unit["location"]),
+                        "owner_id": unit["owner_id"],
+                        "id": unit["id"],
+                        "type": UnitType(unit["type"]),
+                        "actions": unit["actions"],
+                    },
+                )
+                for unit in game_dict["units"]
+            ],
+            cities=[
+                City.model_construct(
+                    location=_coord_from_dict(city["location"]),
+                    owner_id=city["owner_id"],
+                    id=city["id"],
+                    name=city["name"],
+                    workers=[
+                        _construct(
+                            Worker,
+                            {
+                                "location": _coord_from_dict(
+                                    worker["location"]
+                                ),
+                                "id": worker["id"],
+                                "yields": worker["yields"],
+                            },
+                        )
+                        for worker in city["workers"]
+                    ],
+                    actions=city["actions"],
+                )
+                for city in game_dict["cities"]
+            ],
+            current_player_idx=game_dict["current_player_idx"],
+            version=game_dict.get("version", 0),
+            seed=game_dict.get("seed"),
+            rng_state=game_dict.get("rng_state"),
+        )
+
     @property
     def current_player(self):
         return self.players[self.current_player_idx]
 
+    def model_post_init(self, __context) -> None:
+        if self.seed is None:
+            self.seed = getrandbits(64)
+        self._rng = np.random.Generator(np.random.PCG64(self.seed))
+        if self.rng_state is not None:
+            self._rng.bit_generator.state = {
+                **self.rng_state,
+                "state": {
+                    k: int(v) for k, v in self.rng_state["state"].items()
+                },
+            }
+        self.reindex()
+
+    @property
+    def rng(self) -> np.random.Generator:
+        return self._rng
+
+    def clone(self) -> "Game":
+        # cheaper than model_copy(deep=True): the board is never modified
+        # and is shared, units, cities and players are copied one level down
+        return Game.model_construct(
+            board=self.board,
+            players=[player.model_copy() for player in self.players],
+            units=[unit.model_copy() for unit in self.units],
+            cities=[city.clone() for city in self.cities],
+            current_player_idx=self.current_player_idx,
+            version=self.version,
+            seed=self.seed,
+            rng_state=self._rng.bit_generator.state,
+        )
+
+    def reindex(self) -> None:
+        # the indexes are kept up to date by the methods below, call this
+        # after changing units, cities or players in any other way
+        self._units_by_id = {unit.id: unit for unit in self.units}
+        self._distance_fields = {}
+        self._units_by_location = {unit.location: unit for unit in self.units}
+        self._cities_by_id = {city.id: city for city in self.cities}
+        self._players_by_id = {player.id: player for player in self.players}
+        self._workers_by_location = {
+            worker.location: worker
+            for city in self.cities
+            for worker in city.workers
+        }
+
     def unit_from_location(self, location: HexCoord) -> Optional[Unit]:
-        for unit in self.units:
-            if unit.location == location:
-                return unit
-        return None
-
-    def worker_from_location(self, location: HexCoord) -> Optional[Unit]:
-        for city in self.cities:
-            for worker in city.workers:
-                if worker.location == location:
-                    return worker
-        return None
+        return self._units_by_location.get(location)
+
+    def worker_from_location(self, location: HexCoord) -> Optional[Worker]:
+        return self._workers_by_location.get(location)
 
     def unit_from_id(self, unit_id: int) -> Unit:
-        for unit in self.units:
-            if unit.id == unit_id:
-                return unit
-        raise ValueError(f"Unit {unit_id} not found")
+        unit = self._units_by_id.get(unit_id)
+        if unit is None:
+            raise ValueError(f"Unit {unit_id} not found")
+        return unit
 
-    def city_from_id(self, city_id: int) -> Unit:
-        for city in self.cities:
-            if city.id == city_id:
-                return city
-        raise ValueError(f"City {city_id} not found")
+    def city_from_id(self, city_id: int) -> City:
+        city = self._cities_by_id.get(city_id)
+        if city is None:
+            raise ValueError(f"City {city_id} not found")
+        return city
 
     def player_from_id(self, player_id: int) -> Player:
-        for player in self.players:
-            if player.id == player_id:
-                return player
-        raise ValueError(f"Player {player_id} not found")
+        player = self._players_by_id.get(player_id)
+        if player is None:
+            raise ValueError(f"Player {player_id} not found")
+        return player
+
+    # New ids only depend on the current state, so that a game reloaded
+    # from a snapshot and its action log gives the same ids as the live one.
+    # Ids of removed units can be given again.
+    def new_unit_id(self) -> int:
+        return max(self._units_by_id, default=-1) + 1
 
-    def build_empty(board: HexBoard, players: List[Player]) -> "Game":
+    def new_worker_id(self) -> int:
+        return (
+            max(
+                (w.id for city in self.cities for w in city.workers),
+                default=-1,
+            )
+            + 1
+        )
+
+    def add_unit(self, unit: Unit) -> None:
+        self.units.append(unit)
+        self._units_by_id[unit.id] = unit
+        self._units_by_location[unit.location] = unit
+        self._distance_fields.clear()
+
+    def remove_unit(self, unit: Unit) -> None:
+        self.units.remove(unit)
+        del self._units_by_id[unit.id]
+        del self._units_by_location[unit.location]
+        self._distance_fields.clear()
+
+    def move_unit(
+        self, unit: Unit, to: HexCoord, cost: Optional[int] = None
+    ) -> None:
+        # cost defaults to the cheapest path on the board
+        occupant = self._units_by_location.get(to)
+        if occupant is not None and occupant is not unit:
+            raise IllegalActionException(
+                f"Unit {unit.id} cannot move to {to}, occupied by unit "
+                f"{occupant.id}",
+                reason="occupied_cell",
+            )
+        if cost is None:
+            cost = self.reachable(unit).get(to)
+            if cost is None:
+                raise IllegalActionException(
+                    f"Unit {unit.id} cannot reach {to} "
+                    f"with {unit.actions} actions left",
+                    reason="unreachable",
+                )
+        old_location = unit.location
+        unit.move_to(to=to, board=self.board, cost=cost)
+        del self._units_by_location[old_location]
+        self._units_by_location[unit.location] = unit
+        self._distance_fields.clear()
+
+    def reachable(self, unit: Unit) -> Dict[HexCoord, int]:
+        # cost of each cell the unit can reach with its actions left, its own
+        # cell included. Units can walk through cells of their owner, not
+        # through enemies. Cached until a unit is added, moved or removed
+        key = (unit.location, unit.type, unit.owner_id, unit.actions)
+        field = self._distance_fields.get(key)
+        if field is None:
+            blocked = {
+                location
+                for location, other in self._units_by_location.items()
+                if other.owner_id != unit.owner_id
+            }
+            field = distance_field(
+                self.board, unit.type, unit.location, unit.actions, blocked
+            )
+            self._distance_fields[key] = field
+        return field
+
+    def add_worker(self, city: City, worker: Worker) -> None:
+        city.add_worker(worker)
+        self._workers_by_location[worker.location] = worker
+
+    def build_empty(
+        board: HexBoard, players: List[Player], seed: Optional[int] = None
+    ) -> "Game":
         return Game(
-            board=board, players=players, units=[], cities=[], current_player_idx=0
+            board=board,
+            players=players,
+            units=[],
+            cities=[],
+            current_player_idx=0,
+            seed=seed,
         )
 
 
-def get_game(game_id: int) -> Game:
-    filename = f"data/games/{game_id:03}.json"
-    # check if files exists
-    with open(filename, "r") as f:
-        game_dict = json.loads(f.read())
-        game = Game(**game_dict)
-    return game
-
-
-def new_game(game: Game, game_id: int | None) -> int:
-    if game_id is None:
-        game_id = 0
-        for file_path in listdir("data/games"):
-            game_id = max(int(file_path[:-5]) + 1, game_id)
-    filename = f"data/games/{game_id:03}.json"
-    with open(filename, "w") as f:
-        f.write(json.dumps(game.model_dump(mode="json")))
-    return game_id
+def _construct(cls: Type[ModelT], values: Dict[str, Any]) -> ModelT:
+    # same as cls.model_construct(**values) with every field given, for
+    # models without private attributes or model_post_init, several times
+    # faster for the many small models of a game
+    model = cls.__new__(cls)
+    object.__setattr__(model, "__dict__", values)
+    object.__setattr__(model, "__pydantic_fields_set__", set(values))
+    object.__setattr__(model, "__pydantic_extra__", None)
+    object.__setattr__(model, "__pydantic_private__", None)
+    return model
+
+
+def _coord_from_dict(coord: Dict[str, int]) -> HexCoord:
+    return HexCoord(coord["q"], coord["r"], coord["s"])
+
+
+def _board_from_dict(board: Dict[str, Any]) -> HexBoard:
+    if "packed" in board:
+        return HexBoard.from_bytes(base64.b64decode(board["packed"]))
+    return HexBoard.model_construct(
+        **HexBoard.from_raw_board(board["radius"], board["raw_board"])
+    )
@@ -0,0 +1,267 @@
+import weakref
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.game_logic.actions import (
+    Action,
+    ActionParamAttack,
+    ActionParamBuildUnit,
+    ActionParamBuildWorker,
+    ActionParamEndTurn,
+    ActionParamMoveUnit,
+    ActionType,
+    attack_units,
+)
+from src.game_logic.board import HexCoord
+from src.game_logic.exceptions import IllegalActionException
+from src.game_logic.game import Game
+from src.game_logic.units import Unit, UnitStats, UnitType
+
+# Actions are built with model_construct, their content is checked here
+# against the same rules as the action_* functions.
+
+# (unit id, owner id) of the unit in each occupied cell
+Occupancy = Dict[HexCoord, Tuple[int, int]]
+UnitEntry = Tuple[HexCoord, int, UnitStats, List[Action], List[Action]]
+
+
+def legal_actions(
+    game: Game, player_id: int, game_id: int = 0
+) -> List[Action]:
+    # actions that the player can take now, empty when not their turn.
+    # Results are cached per game version: the game must only be changed
+    # through apply_action, or have its version increased. The returned
+    # list is shared, do not modify it
+    if game.current_player.id != player_id:
+        return []
+    cache = _caches.get(id(game))
+    if cache is None:
+        cache = LegalActionsCache()
+        _caches[id(game)] = cache
+        weakref.finalize(game, _caches.pop, id(game), None)
+    return cache.get(game, player_id, game_id)
+
+
+def unit_moves(
+    game: Game, unit: Unit, occupied: Occupancy, game_id: int = 0
+) -> List[Action]:
+    actions = []
+    for location in game.reachable(unit):
+        if location in occupied:
+            continue
+        actions.append(
+            Action.model_construct(
+                action_type=ActionType.move_unit,
+                params=ActionParamMoveUnit.model_construct(
+                    game_id=game_id,
+                    player_id=unit.owner_id,
+                    unit_id=unit.id,
+                    move_to=location,
+                ),
+            )
+        )
+    return actions
+
+
+def unit_attacks(
+    game: Game, unit: Unit, occupied: Occupancy, game_id: int = 0
+) -> List[Action]:
+    # attacks by the unit alone on enemies within its range (at least 1).
+    # Combined attacks are legal too, but not enumerated as their number
+    # grows exponentially with the units
+    actions = []
+    for location in unit.location.range(attack_range(unit)):
+        attacked = occupied.get(location)
+        if attacked is None or attacked[1] == unit.owner_id:
+            continue
+        params = ActionParamAttack.model_construct(
+            game_id=game_id,
+            player_id=unit.owner_id,
+            attacking_unit_ids=[unit.id],
+            attacked_unit_id=attacked[0],
+        )
+        try:
+            attack_units(game, params)
+        except IllegalActionException:
+            continue
+        actions.append(
+            Action.model_construct(
+                action_type=ActionType.attack, params=params
+            )
+        )
+    return actions
+
+
+def attack_range(unit: Unit) -> int:
+    return max(1, unit.stats.range)
+
+
+def legal_moves(game: Game, player_id: int, game_id: int = 0) -> List[Action]:
+    occupied = occupancy(game)
+    return [
+        action
+        for unit in game.units
+        if unit.owner_id == player_id and unit.actions > 0
+        for action in unit_moves(game, unit, occupied, game_id)
+    ]
+
+
+def legal_attacks(
+    game: Game, player_id: int, game_id: int = 0
+) -> List[Action]:
+    occupied = occupancy(game)
+    return [
+        action
+        for unit in game.units
+        if unit.owner_id == player_id and unit.actions > 0
+        for action in unit_attacks(game, unit, occupied, game_id)
+    ]
+
+
+def legal_builds(game: Game, player_id: int, game_id: int = 0) -> List[Action]:
+    budget = game.player_from_id(player_id).budget
+    actions = []
+    for city in game.cities:
+        if (
+            city.owner_id != player_id
+            or city.actions < 1
+            or game.unit_from_location(city.location) is not None
+        ):
+            continue
+        for type in UnitType:
+            if UnitStats.from_type(type).cost > budget:
+                continue
+            actions.append(
+                Action.model_construct(
+                    action_type=ActionType.build_unit,
+                    params=ActionParamBuildUnit.model_construct(
+                        game_id=game_id,
+                        player_id=player_id,
+                        city_id=city.id,
+                        type=type,
+                    ),
+                )
+            )
+    return actions
+
+
+def legal_workers(
+    game: Game, player_id: int, game_id: int = 0
+) -> List[Action]:
+    # free cells next to the city or to one of its workers
+    board = game.board
+    actions = []
+    for city in game.cities:
+        if city.owner_id != player_id or city.actions < 1:
+            continue
+        locations: Set[HexCoord] = set(city.location.range(1))
+        for worker in city.workers:
+            locations.update(worker.location.range(1))
+        for location in sorted(locations):
+            if (
+                not board.valid_coord(location)
+                or game.worker_from_location(location) is not None
+                or not city.is_worker_location_valid(location)
+            ):
+                continue
+            actions.append(
+                Action.model_construct(
+                    action_type=ActionType.build_worker,
+                    params=ActionParamBuildWorker.model_construct(
+                        game_id=game_id,
+                        player_id=player_id,
+                        city_id=city.id,
+                        location=location,
+                    ),
+                )
+            )
+    return actions
+
+
+def occupancy(game: Game) -> Occupancy:
+    return {unit.location: (unit.id, unit.owner_id) for unit in game.units}
+
+
+class LegalActionsCache:
+    """Legal actions of a game, recomputed incrementally between versions.
+
+    The moves and attacks of a unit are reused when the unit has not changed
+    and no cell within its reach changed occupant since the previous call.
+    Builds and workers are cheap and always recomputed.
+    """
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.key: Optional[Tuple[int, int]] = None
+        self.actions: List[Action] = []
+        self.occupied: Occupancy = {}
+        # unit id -> location, actions, stats, moves and attacks
+        self.units: Dict[int, UnitEntry] = {}
+
+    def get(self, game: Game, player_id: int, game_id: int) -> List[Action]:
+        key = (player_id, game_id)
+        if self.version == game.version and self.key == key:
+            return self.actions
+
+        occupied = occupancy(game)
+        if self.key == key:
+            changed = [
+                location
+                for location in self.occupied.keys() | occupied.keys()
+                if self.occupied.get(location) != occupied.get(location)
+            ]
+            previous_units = self.units
+        else:
+            changed = []
+            previous_units = {}
+
+        units: Dict[int, UnitEntry] = {}
+        moves: List[Action] = []
+        attacks: List[Action] = []
+        for unit in game.units:
+            if unit.owner_id != player_id or unit.actions == 0:
+                continue
+            reach = max(unit.actions, attack_range(unit))
+            previous = previous_units.get(unit.id)
+            if (
+                previous is not None
+                and previous[0] == unit.location
+                and previous[1] == unit.actions
+                and previous[2] is unit.stats
+                and all(
+                    unit.location.distance(location) > reach
+                    for location in changed
+                )
+            ):
+                entry = previous
+            else:
+                entry = (
+                    unit.location,
+                    unit.actions,
+                    unit.stats,
+                    unit_moves(game, unit, occupied, game_id),
+                    unit_attacks(game, unit, occupied, game_id),
+                )
+            units[unit.id] = entry
+            moves += entry[3]
+            attacks += entry[4]
+
+        self.actions = [
+            *moves,
+            *attacks,
+            *legal_builds(game, player_id, game_id),
+            *legal_workers(game, player_id, game_id),
+            Action.model_construct(
+                action_type=ActionType.end_turn,
+                params=ActionParamEndTurn.model_construct(
+                    game_id=game_id, player_id=player_id
+                ),
+            ),
+        ]
+        self.version = game.version
+        self.key = key
+        self.occupied = occupied
+        self.units = units
+        return self.actions
+
+
+_caches: Dict[int, LegalActionsCache] = {}
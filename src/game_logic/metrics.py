@@ -0,0 +1,231 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# latency buckets, in seconds
+BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+# values of a metric by label values, as collected from a process
+Samples = Dict[str, Dict[Labels, List[float]]]
+
+
+class Metric(ABC):
+    """Metric in the Prometheus text format, with fixed label names.
+
+    The values of each combination of labels are a list of floats, so that
+    the values collected from several processes can be summed.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def collect(self) -> Dict[Labels, List[float]]:
+        with self._lock:
+            return {
+                labels: list(values) for labels, values in self._values.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    @abstractmethod
+    def lines(self, values: Dict[Labels, List[float]]) -> Iterator[str]:
+        # sample lines of values, as returned by collect
+        ...
+
+    def _label_text(self, labels: Labels, extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.labelnames, labels)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0.0]
+            values[0] += value
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, [0.0])[0]
+
+    def lines(self, values: Dict[Labels, List[float]]) -> Iterator[str]:
+        for labels, (value,) in sorted(values.items()):
+            yield f"{self.name}{self._label_text(labels)} {value!r}"
+
+
+class Histogram(Metric):
+    # values are the count of each bucket, not cumulative, the count of the
+    # larger ones and the sum
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            values[idx] += 1
+            values[-1] += value
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            return int(sum(self._values.get(labels, [0.0])[:-1]))
+
+    def lines(self, values: Dict[Labels, List[float]]) -> Iterator[str]:
+        for labels, counts in sorted(values.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = self._label_text(labels, f'le="{le}"')
+                yield f"{self.name}_bucket{label_text} {cumulative!r}"
+            label_text = self._label_text(labels)
+            yield f"{self.name}_sum{label_text} {counts[-1]!r}"
+            yield f"{self.name}_count{label_text} {cumulative!r}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def collect(self) -> Samples:
+        return {
+            name: metric.collect() for name, metric in self._metrics.items()
+        }
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self, *others: Samples) -> bytes:
+        # the metrics of this process, plus the ones collected from others
+        samples = self.collect()
+        for other in others:
+            for name, values in other.items():
+                merged = samples.setdefault(name, {})
+                for labels, value in values.items():
+                    if labels in merged:
+                        merged[labels] = [
+                            a + b for a, b in zip(merged[labels], value)
+                        ]
+                    else:
+                        merged[labels] = value
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.lines(samples.get(name, {})))
+        return ("\n".join(lines) + "\n").encode()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+# Phases recorded, as labels of game_phase_seconds. Phases can nest, e.g.
+# a load from the storage happens while acquiring the game.
+#   acquire: wait for the game lock, and load the game when not in memory
+#   read, decode, validate, replay: loading from the storage
+#   encode, write: saving to the storage
+#   state, rules, delta, record, append, notify: taking an action
+#   board, build, create: creating a game
+#   serialize: rendering the response
+#   shard: round trip to the shard owning the game
+OPERATION_SECONDS = registry.register(
+    Histogram(
+        "game_operation_seconds",
+        "Duration of the game operations",
+        ["operation"],
+    )
+)
+PHASE_SECONDS = registry.register(
+    Histogram(
+        "game_phase_seconds",
+        "Duration of the phases of the game operations",
+        ["operation", "phase"],
+    )
+)
+
+# operation in progress, phases are recorded under it. Copied to the
+# threads the operation runs storage calls in
+_operation: ContextVar[str] = ContextVar("operation", default="other")
+
+
+@contextmanager
+def timed_operation(operation: str) -> Iterator[None]:
+    token = _operation.set(operation)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        OPERATION_SECONDS.observe(time.perf_counter() - start, operation)
+        _operation.reset(token)
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - start)
+
+
+def observe_phase(phase: str, seconds: float) -> None:
+    PHASE_SECONDS.observe(seconds, _operation.get(), phase)
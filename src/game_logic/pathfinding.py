@@ -0,0 +1,159 @@
+import heapq
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from src.game_logic.board import (
+    CELL_TYPE_CODES,
+    HEX_DIRECTIONS,
+    CellType,
+    HexBoard,
+    HexCoord,
+)
+from src.game_logic.units import UnitType
+
+# actions needed to enter a cell, None when it cannot be entered
+MOVEMENT_COSTS: Dict[CellType, Optional[int]] = {
+    CellType.plain: 1,
+    CellType.city: 1,
+    CellType.hills: 2,
+    CellType.mauntain: None,
+    CellType.see: None,
+    CellType.empty: None,
+}
+# per unit type changes to MOVEMENT_COSTS
+UNIT_MOVEMENT_COSTS: Dict[UnitType, Dict[CellType, Optional[int]]] = {}
+
+
+def movement_costs(unit_type: UnitType) -> Dict[CellType, Optional[int]]:
+    return {**MOVEMENT_COSTS, **UNIT_MOVEMENT_COSTS.get(unit_type, {})}
+
+
+@lru_cache(maxsize=256)
+def _cost_field(
+    radius: int, cell_types: bytes, unit_type: UnitType
+) -> Tuple[int, ...]:
+    # Cost to enter each cell, 0 when it cannot be entered. Cells are stored
+    # like in HexBoard, with one more impassable cell on each side, so that
+    # the neighbors of a cell are always at the same index offsets.
+    costs = movement_costs(unit_type)
+    lut = np.array(
+        [costs[type] or 0 for type in CELL_TYPE_CODES], dtype=np.int64
+    )
+    side_size = 2 * radius + 1
+    field = np.zeros((side_size + 2, side_size + 2), dtype=np.int64)
+    field[1:-1, 1:-1] = lut[
+        np.frombuffer(cell_types, dtype=np.uint8).reshape(side_size, -1)
+    ]
+    return tuple(field.ravel().tolist())
+
+
+def cost_field(board: HexBoard, unit_type: UnitType) -> Tuple[int, ...]:
+    # cached per board content and unit type
+    return _cost_field(board.radius, board.cell_types, unit_type)
+
+
+def _index(board: HexBoard, coord: HexCoord) -> int:
+    width = board.side_size + 2
+    return (coord.q + board.radius + 1) * width + coord.r + board.radius + 1
+
+
+def _coord(board: HexBoard, idx: int) -> HexCoord:
+    row, col = divmod(idx, board.side_size + 2)
+    q = row - board.radius - 1
+    r = col - board.radius - 1
+    return HexCoord(q, r, -q - r)
+
+
+def _offsets(board: HexBoard) -> List[int]:
+    width = board.side_size + 2
+    return [dq * width + dr for dq, dr, _ in HEX_DIRECTIONS]
+
+
+def distance_field(
+    board: HexBoard,
+    unit_type: UnitType,
+    source: HexCoord,
+    max_cost: int,
+    blocked: Set[HexCoord] = set(),
+) -> Dict[HexCoord, int]:
+    # Dijkstra: lowest cost to reach each cell from source, for the cells
+    # that cost at most max_cost. Blocked cells cannot be entered
+    if not board.valid_coord(source):
+        return {}
+    costs = cost_field(board, unit_type)
+    offsets = _offsets(board)
+    blocked_idxs = {
+        _index(board, coord) for coord in blocked if board.valid_coord(coord)
+    }
+    start = _index(board, source)
+    best = {start: 0}
+    queue = [(0, start)]
+    while queue:
+        cost, idx = heapq.heappop(queue)
+        if cost > best[idx]:
+            continue
+        for offset in offsets:
+            next_idx = idx + offset
+            step = costs[next_idx]
+            if step == 0 or next_idx in blocked_idxs:
+                continue
+            next_cost = cost + step
+            if next_cost <= max_cost and next_cost < best.get(
+                next_idx, max_cost + 1
+            ):
+                best[next_idx] = next_cost
+                heapq.heappush(queue, (next_cost, next_idx))
+    return {_coord(board, idx): cost for idx, cost in best.items()}
+
+
+def find_path(
+    board: HexBoard,
+    unit_type: UnitType,
+    start: HexCoord,
+    goal: HexCoord,
+    blocked: Set[HexCoord] = set(),
+) -> Optional[List[HexCoord]]:
+    # A*: cheapest path from start to goal, both included, or None when
+    # the goal cannot be reached. Every step costs at least 1, so the hex
+    # distance never overestimates the cost
+    if not board.valid_coord(start) or not board.valid_coord(goal):
+        return None
+    costs = cost_field(board, unit_type)
+    offsets = _offsets(board)
+    blocked_idxs = {
+        _index(board, coord) for coord in blocked if board.valid_coord(coord)
+    }
+    start_idx = _index(board, start)
+    goal_idx = _index(board, goal)
+    best = {start_idx: 0}
+    previous: Dict[int, int] = {}
+    queue = [(start.distance(goal), 0, start_idx)]
+    while queue:
+        _, cost, idx = heapq.heappop(queue)
+        if idx == goal_idx:
+            path = [idx]
+            while path[-1] != start_idx:
+                path.append(previous[path[-1]])
+            return [_coord(board, idx) for idx in reversed(path)]
+        if cost > best[idx]:
+            continue
+        for offset in offsets:
+            next_idx = idx + offset
+            step = costs[next_idx]
+            if step == 0 or next_idx in blocked_idxs:
+                continue
+            next_cost = cost + step
+            if next_cost < best.get(next_idx, next_cost + 1):
+                best[next_idx] = next_cost
+                previous[next_idx] = idx
+                heapq.heappush(
+                    queue,
+                    (
+                        next_cost + _coord(board, next_idx).distance(goal),
+                        next_cost,
+                        next_idx,
+                    ),
+                )
+    return None
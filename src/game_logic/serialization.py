@@ -0,0 +1,65 @@
+import json
+from typing import Any, Dict, Type, Union
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonSerializer:
+    # Pydantic models are written by pydantic itself, straight to json
+    # without building a dict first. Plain data goes through the json
+    # library of the serializer.
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        if isinstance(obj, BaseModel):
+            return obj.model_dump_json().encode()
+        return self.dumps_data(obj)
+
+    def dumps_data(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=_default).encode()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JsonSerializer):
+    # orjson only handles 64 bit integers
+    name = "orjson"
+
+    def dumps_data(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+def _default(obj: Any) -> Any:
+    # pydantic models nested in plain data
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+SERIALIZERS: Dict[str, Type[JsonSerializer]] = {"json": JsonSerializer}
+if orjson is not None:
+    SERIALIZERS["orjson"] = OrjsonSerializer
+
+_serializer: JsonSerializer = SERIALIZERS.get("orjson", JsonSerializer)()
+
+
+def get_serializer() -> JsonSerializer:
+    return _serializer
+
+
+def set_serializer(name: str) -> None:
+    global _serializer
+    if name not in SERIALIZERS:
+        raise ValueError(
+            f"Unknown serializer {name}, available: {list(SERIALIZERS)}"
+        )
+    _serializer = SERIALIZERS[name]()
@@ -0,0 +1,408 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    Optional,
+)
+
+from src.game_logic.exceptions import (
+    GameConflictException,
+    IllegalActionException,
+)
+from src.game_logic.game import Game
+from src.game_logic.metrics import observe_phase, timed_operation
+from src.game_logic.storage import (
+    GAMES_DIR,
+    FileStorage,
+    Storage,
+    ThreadedStorage,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_GAMES = 1024
+TTL = 15 * 60.0
+FLUSH_INTERVAL = 1.0
+LOCK_POLL_INTERVAL = 0.001
+# raised before changing the game, which stays in memory
+REJECTIONS = (IllegalActionException, GameConflictException)
+
+
+class GameSession:
+    def __init__(self, game: Game):
+        self.game = game
+        self.lock = threading.RLock()
+        # coroutines all run in the event loop thread, where the RLock does
+        # not exclude them from each other
+        self.async_lock = asyncio.Lock()
+        self.dirty = False
+        self.last_access = time.monotonic()
+        # revision of the stored game this one matches, for shared storages
+        self.revision: Optional[int] = None
+
+
+class SessionStore:
+    """Keeps live games in memory in front of a storage.
+
+    Games are loaded and validated once, then served from memory. Changes
+    are flushed back to the storage by a background thread (write-behind),
+    on eviction and at exit.
+
+    With shared=True, for storages shared by several processes (e.g.
+    uvicorn workers), games are locked in the storage while in use, reloaded
+    when another process changed them and written through.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        max_games: int = MAX_GAMES,
+        ttl: float = TTL,
+        shared: bool = False,
+    ):
+        self.storage = storage
+        self.async_storage = ThreadedStorage(storage)
+        self.max_games = max_games
+        self.ttl = ttl
+        self.shared = shared
+        self._sessions: OrderedDict[int, GameSession] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[int, threading.Lock] = {}
+        _all_stores.add(self)
+
+    def __contains__(self, game_id: int) -> bool:
+        return game_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _cached_session(self, game_id: int) -> Optional[GameSession]:
+        with self._lock:
+            session = self._sessions.get(game_id)
+            if session is not None:
+                self._sessions.move_to_end(game_id)
+                session.last_access = time.monotonic()
+            return session
+
+    def _session(self, game_id: int) -> GameSession:
+        session = self._cached_session(game_id)
+        if session is not None:
+            return session
+        with self._lock:
+            loading = self._loading.setdefault(game_id, threading.Lock())
+
+        # load outside of the store lock, so that a slow load does not block
+        # requests on other games
+        with loading:
+            with self._lock:
+                session = self._sessions.get(game_id)
+            if session is None:
+                try:
+                    with self._storage_lock(game_id):
+                        session = GameSession(self.storage.load(game_id))
+                        if self.shared:
+                            session.revision = self.storage.revision(game_id)
+                    with self._lock:
+                        self._sessions[game_id] = session
+                finally:
+                    with self._lock:
+                        self._loading.pop(game_id, None)
+        self.evict()
+        return session
+
+    def _storage_lock(self, game_id: int) -> ContextManager:
+        if self.shared:
+            return self.storage.lock(game_id)
+        return nullcontext()
+
+    def _async_storage_lock(self, game_id: int) -> AsyncContextManager:
+        if self.shared:
+            return self.async_storage.lock(game_id)
+        return nullcontext()
+
+    def _sync(self, game_id: int, session: GameSession) -> None:
+        # with the game locked in a shared storage, reloads it if another
+        # process changed it
+        if self.storage.revision(game_id) == session.revision:
+            return
+        session.game = self.storage.load(game_id)
+        session.revision = self.storage.revision(game_id)
+        session.dirty = False
+
+    def _write_through(self, game_id: int, session: GameSession) -> None:
+        # with the game locked in a shared storage, other processes must see
+        # the changes once it is unlocked
+        if session.dirty:
+            self.storage.save(game_id, session.game)
+            session.dirty = False
+        session.revision = self.storage.revision(game_id)
+
+    def _discard(self, game_id: int, session: GameSession) -> None:
+        # the game may have been left half changed: it is reloaded from the
+        # storage next time, which loses the changes not written yet
+        if session.dirty:
+            logger.error(f"Dropping unsaved changes of game {game_id}")
+        with self._lock:
+            if self._sessions.get(game_id) is session:
+                del self._sessions[game_id]
+
+    @contextmanager
+    def acquire(self, game_id: int) -> Iterator[Game]:
+        # the session can be evicted between the lookup and the locking, in
+        # that case look it up again
+        start = time.perf_counter()
+        while True:
+            session = self._session(game_id)
+            with session.lock:
+                if self._sessions.get(game_id) is not session:
+                    continue
+                with self._storage_lock(game_id):
+                    if self.shared:
+                        self._sync(game_id, session)
+                    observe_phase("acquire", time.perf_counter() - start)
+                    try:
+                        yield session.game
+                    except REJECTIONS:
+                        raise
+                    except BaseException:
+                        self._discard(game_id, session)
+                        raise
+                    if self.shared:
+                        self._write_through(game_id, session)
+                return
+
+    @asynccontextmanager
+    async def acquire_async(self, game_id: int) -> AsyncIterator[Game]:
+        # same as acquire, without blocking the event loop: loading runs in
+        # a worker thread, and the thread lock, held by other threads only
+        # for short in memory work or a flush, is polled
+        start = time.perf_counter()
+        while True:
+            session = self._cached_session(game_id)
+            if session is None:
+                session = await asyncio.to_thread(self._session, game_id)
+            async with session.async_lock:
+                while not session.lock.acquire(blocking=False):
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+                try:
+                    if self._sessions.get(game_id) is not session:
+                        continue
+                    async with self._async_storage_lock(game_id):
+                        if self.shared:
+                            await asyncio.to_thread(
+                                self._sync, game_id, session
+                            )
+                        observe_phase("acquire", time.perf_counter() - start)
+                        try:
+                            yield session.game
+                        except REJECTIONS:
+                            raise
+                        except BaseException:
+                            self._discard(game_id, session)
+                            raise
+                        if self.shared:
+                            await asyncio.to_thread(
+                                self._write_through, game_id, session
+                            )
+                    return
+                finally:
+                    session.lock.release()
+
+    def append(self, game_id: int, record: Dict) -> None:
+        # records an action applied to a game held through acquire, the game
+        # is flushed later when the storage does not persist it right away
+        session = self._sessions[game_id]
+        if not self.storage.append(game_id, session.game, record):
+            session.dirty = True
+
+    async def append_async(self, game_id: int, record: Dict) -> None:
+        # records an action applied to a game held through acquire_async
+        session = self._sessions[game_id]
+        if not await self.async_storage.append(game_id, session.game, record):
+            session.dirty = True
+
+    def get(self, game_id: int) -> Game:
+        if self.shared:
+            with self.acquire(game_id) as game:
+                return game
+        return self._session(game_id).game
+
+    async def get_async(self, game_id: int) -> Game:
+        if self.shared:
+            async with self.acquire_async(game_id) as game:
+                return game
+        session = self._cached_session(game_id)
+        if session is None:
+            session = await asyncio.to_thread(self._session, game_id)
+        return session.game
+
+    def create(self, game: Game, game_id: Optional[int] = None) -> int:
+        # new ids are claimed in the storage, new games are written through
+        if game_id is None:
+            game_id = self.storage.new_id()
+        session = GameSession(game)
+        with self._storage_lock(game_id):
+            self.storage.save(game_id, game)
+            if self.shared:
+                session.revision = self.storage.revision(game_id)
+        with self._lock:
+            self._sessions[game_id] = session
+        self.evict()
+        return game_id
+
+    async def create_async(
+        self, game: Game, game_id: Optional[int] = None
+    ) -> int:
+        return await asyncio.to_thread(self.create, game, game_id)
+
+    def _flush_session(self, game_id: int, session: GameSession) -> None:
+        with session.lock:
+            if not session.dirty:
+                return
+            try:
+                self.storage.save(game_id, session.game)
+            except FileNotFoundError:
+                logger.warning(
+                    f"Storage for game {game_id} is gone, dropping session"
+                )
+                with self._lock:
+                    self._sessions.pop(game_id, None)
+            session.dirty = False
+
+    def flush(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for game_id, session in sessions:
+            self._flush_session(game_id, session)
+
+    def evict(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                (game_id, session)
+                for idx, (game_id, session) in enumerate(
+                    self._sessions.items()
+                )
+                if idx < len(self._sessions) - self.max_games
+                or now - session.last_access > self.ttl
+            ]
+        for game_id, session in candidates:
+            # games in use are skipped, they will be evicted later on
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                self._flush_session(game_id, session)
+                with self._lock:
+                    if self._sessions.get(game_id) is session:
+                        del self._sessions[game_id]
+            finally:
+                session.lock.release()
+
+    def clear(self) -> None:
+        self.flush()
+        with self._lock:
+            self._sessions.clear()
+
+
+_stores: Dict[str, SessionStore] = {}
+# every store, also the ones not created by get_session_store
+_all_stores: "weakref.WeakSet[SessionStore]" = weakref.WeakSet()
+_stores_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+_storage_factory: Callable[[str], Storage] = FileStorage
+_shared_storage = False
+
+
+def is_resident(storage: Storage, game_id: int) -> bool:
+    # whether a store in this process holds the game in memory, possibly
+    # with changes not written to the storage yet
+    return any(
+        store.storage is storage and game_id in store
+        for store in list(_all_stores)
+    )
+
+
+def set_storage_factory(factory: Callable[[str], Storage]) -> None:
+    # only affects stores created afterwards
+    global _storage_factory
+    _storage_factory = factory
+
+
+def set_shared_storage(shared: bool) -> None:
+    # whether storages are shared with other processes, only affects stores
+    # created afterwards
+    global _shared_storage
+    _shared_storage = shared
+
+
+def get_session_store(file_dir: str = GAMES_DIR) -> SessionStore:
+    with _stores_lock:
+        store = _stores.get(file_dir)
+        if store is None:
+            store = SessionStore(
+                _storage_factory(file_dir), shared=_shared_storage
+            )
+            _stores[file_dir] = store
+            _start_flusher()
+    return store
+
+
+def flush_sessions() -> None:
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with _stores_lock:
+            stores = list(_stores.values())
+        for store in stores:
+            try:
+                with timed_operation("flush"):
+                    store.flush()
+                    store.evict()
+                store.storage.maintain()
+            except Exception:
+                logger.exception("Failed to flush game sessions")
+
+
+def _start_flusher() -> None:
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, daemon=True)
+        _flusher.start()
+        atexit.register(flush_sessions)
+
+
+def get_game(game_id: int, file_dir: str = GAMES_DIR) -> Game:
+    return get_session_store(file_dir).get(game_id)
+
+
+async def get_game_async(game_id: int, file_dir: str = GAMES_DIR) -> Game:
+    return await get_session_store(file_dir).get_async(game_id)
+
+
+def new_game(
+    game: Game, game_id: Optional[int], file_dir: str = GAMES_DIR
+) -> int:
+    return get_session_store(file_dir).create(game, game_id)
+
+
+async def new_game_async(
+    game: Game, game_id: Optional[int], file_dir: str = GAMES_DIR
+) -> int:
+    return await get_session_store(file_dir).create_async(game, game_id)
@@ -0,0 +1,295 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.game_logic.actions import (
+    Action,
+    ActionParamAttack,
+    attack_win_probability,
+    take_action_delta,
+)
+from src.game_logic.delta import game_json
+from src.game_logic.game import Game
+from src.game_logic.legal_actions import legal_actions
+from src.game_logic.metrics import Samples, registry, timed_operation
+from src.game_logic.serialization import get_serializer
+from src.game_logic.session import (
+    flush_sessions,
+    get_session_store,
+    set_shared_storage,
+    set_storage_factory,
+)
+from src.game_logic.storage import GAMES_DIR, FileStorage, Storage
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0
+
+
+# Operations run by the shards, on games they own. Arguments and results
+# cross the process boundary, so games travel as json.
+
+
+def _get_game(
+    file_dir: str,
+    game_id: int,
+    packed_board: bool,
+    since_version: Optional[int],
+) -> bytes:
+    with get_session_store(file_dir).acquire(game_id) as game:
+        return game_json(game, packed_board, since_version)
+
+
+def _take_action(
+    file_dir: str, game_id: int, action_json: bytes, delta: bool
+) -> Tuple[bytes, bytes]:
+    # returns the response, and the delta for the subscribers of the game
+    serializer = get_serializer()
+    action_delta = take_action_delta(
+        Action.model_validate_json(action_json), file_dir
+    )
+    delta_json = serializer.dumps(action_delta)
+    if delta:
+        return delta_json, delta_json
+    with get_session_store(file_dir).acquire(game_id) as game:
+        return serializer.dumps(game), delta_json
+
+
+def _legal_actions(
+    file_dir: str, game_id: int, player_id: Optional[int]
+) -> bytes:
+    with get_session_store(file_dir).acquire(game_id) as game:
+        if player_id is None:
+            player_id = game.current_player.id
+        return get_serializer().dumps_data(
+            legal_actions(game, player_id, game_id)
+        )
+
+
+def _get_board(file_dir: str, game_id: int) -> bytes:
+    with get_session_store(file_dir).acquire(game_id) as game:
+        return game.board.to_bytes()
+
+
+def _attack_probability(
+    file_dir: str, game_id: int, params_json: bytes
+) -> float:
+    params = ActionParamAttack.model_validate_json(params_json)
+    with get_session_store(file_dir).acquire(game_id) as game:
+        return attack_win_probability(game, params)
+
+
+def _new_game(file_dir: str, game_id: int, game_data: bytes) -> None:
+    game = Game.from_trusted_dict(get_serializer().loads(game_data))
+    get_session_store(file_dir).create(game, game_id)
+
+
+def _metrics(file_dir: str, game_id: int) -> Samples:
+    # game_id only picks the shard
+    return registry.collect()
+
+
+SHARD_OPERATIONS: Dict[str, Callable[..., Any]] = {
+    "get_game": _get_game,
+    "take_action": _take_action,
+    "legal_actions": _legal_actions,
+    "get_board": _get_board,
+    "attack_probability": _attack_probability,
+    "new_game": _new_game,
+    "metrics": _metrics,
+}
+
+
+def _shard_main(
+    file_dir: str,
+    storage_factory: Callable[[str], Storage],
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue,
+) -> None:
+    # requests are served one at a time, on games kept in memory
+    set_storage_factory(storage_factory)
+    # games are written through, and locked in the storage: a crashed shard
+    # loses no acknowledged action, and pools of several api workers, which
+    # all route a game to their own shard, do not overwrite each other
+    set_shared_storage(True)
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+            request_id, operation, args = request
+            try:
+                # timed apart from the same operation in the api process,
+                # which includes the round trip to the shard
+                with timed_operation(f"shard_{operation}"):
+                    result = SHARD_OPERATIONS[operation](file_dir, *args)
+                responses.put((request_id, result, None))
+            except Exception as e:
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = RuntimeError(repr(e))
+                responses.put((request_id, None, e))
+    finally:
+        flush_sessions()
+        responses.put(None)
+
+
+class Shard:
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.process: Optional[multiprocessing.Process] = None
+        self.requests: Optional[multiprocessing.Queue] = None
+        self.responses: Optional[multiprocessing.Queue] = None
+        self.reader: Optional[threading.Thread] = None
+        # request id to the loop and the future awaiting the response
+        self.pending: Dict[
+            int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]
+        ] = {}
+        # held while sending a request, and while a restart fails the
+        # pending requests and replaces the queues
+        self.lock = threading.Lock()
+
+
+class ShardPool:
+    """Games partitioned over long lived worker processes.
+
+    Each game is owned by the shard game_id % n_shards, which keeps it in
+    memory and applies its actions one at a time. The api process forwards
+    the requests on a game to its shard over multiprocessing queues.
+
+    Shards use a shared storage (see SessionStore): every change is written
+    before it is acknowledged, and games are locked in the storage while in
+    use. Several api workers, each with its own pool, are safe but slower
+    than one: a game is then reloaded by the shards of each worker in turn.
+    """
+
+    def __init__(
+        self,
+        n_shards: int,
+        file_dir: str = GAMES_DIR,
+        storage_factory: Callable[[str], Storage] = FileStorage,
+    ):
+        self.file_dir = file_dir
+        self.storage_factory = storage_factory
+        self._shards = [Shard(idx) for idx in range(n_shards)]
+        self._request_ids = itertools.count()
+        self._context = multiprocessing.get_context("spawn")
+        self._stopped = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def shard(self, game_id: int) -> Shard:
+        return self._shards[game_id % len(self._shards)]
+
+    def start(self) -> None:
+        self._stopped.clear()
+        for shard in self._shards:
+            shard.requests = self._context.Queue()
+            shard.responses = self._context.Queue()
+            self._start_process(shard)
+            shard.reader = threading.Thread(
+                target=self._read_responses, args=(shard,), daemon=True
+            )
+            shard.reader.start()
+
+    def _start_process(self, shard: Shard) -> None:
+        shard.process = self._context.Process(
+            target=_shard_main,
+            args=(
+                self.file_dir,
+                self.storage_factory,
+                shard.requests,
+                shard.responses,
+            ),
+            name=f"game-shard-{shard.idx}",
+            daemon=True,
+        )
+        shard.process.start()
+
+    def stop(self) -> None:
+        # the shards flush their games before exiting
+        self._stopped.set()
+        for shard in self._shards:
+            shard.requests.put(None)
+        for shard in self._shards:
+            shard.process.join()
+            shard.reader.join()
+            # releases the semaphores of the queues
+            shard.process = shard.reader = None
+            shard.requests = shard.responses = None
+
+    async def call(self, game_id: int, operation: str, *args: Any) -> Any:
+        shard = self.shard(game_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = next(self._request_ids)
+        with shard.lock:
+            shard.pending[request_id] = (loop, future)
+            shard.requests.put((request_id, operation, (game_id,) + args))
+        return await future
+
+    async def collect_metrics(self) -> List[Samples]:
+        return await asyncio.gather(
+            *(self.call(shard.idx, "metrics") for shard in self._shards)
+        )
+
+    def _read_responses(self, shard: Shard) -> None:
+        while True:
+            try:
+                response = shard.responses.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if shard.process.is_alive():
+                    continue
+                response = None
+            if response is None:
+                # the shard stopped, or crashed
+                if self._stopped.is_set():
+                    return
+                self._restart(shard)
+                continue
+            request_id, result, error = response
+            waiter = shard.pending.pop(request_id, None)
+            if waiter is not None:
+                loop, future = waiter
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def _restart(self, shard: Shard) -> None:
+        # the games of a crashed shard are reloaded from the storage, the
+        # requests it was serving are failed
+        logger.error(
+            f"Game shard {shard.idx} exited with code "
+            f"{shard.process.exitcode}, restarting it"
+        )
+        # requests sent from now on go to the new process, through new
+        # queues: the old ones may have been left locked by the dead process
+        with shard.lock:
+            pending = list(shard.pending.values())
+            shard.pending.clear()
+            shard.requests = self._context.Queue()
+            shard.responses = self._context.Queue()
+        self._start_process(shard)
+        for loop, future in pending:
+            loop.call_soon_threadsafe(
+                _resolve,
+                future,
+                None,
+                RuntimeError(f"Game shard {shard.idx} exited"),
+            )
+
+
+def _resolve(
+    future: asyncio.Future, result: Any, error: Optional[Exception]
+) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
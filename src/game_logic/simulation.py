@@ -0,0 +1,237 @@
+import argparse
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from random import getrandbits
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from src.game_logic.actions import Action, ActionType, apply_action
+from src.game_logic.board import HexBoard, HexCoord
+from src.game_logic.city import City
+from src.game_logic.game import Game
+from src.game_logic.legal_actions import legal_actions
+from src.game_logic.player import Player
+
+logger = logging.getLogger(__name__)
+
+RADIUS = 10
+N_PLAYERS = 2
+BUDGET = 10
+MAX_TURNS = 50
+
+Policy = Callable[[Game, List[Action], np.random.Generator], Action]
+
+
+class GameResult(BaseModel):
+    seed: int
+    turns: int
+    actions: int
+    # None on a draw
+    winner_id: Optional[int]
+    units_alive: Dict[int, int]
+    units_built: Dict[str, int]
+    units_lost: Dict[str, int]
+
+
+class BatchReport(BaseModel):
+    games: int
+    seconds: float
+    games_per_second: float
+    actions_per_second: float
+    wins: Dict[int, int]
+    draws: int
+    mean_turns: float
+    mean_actions: float
+    units_built: Dict[str, int]
+    units_lost: Dict[str, int]
+
+
+def setup_game(
+    radius: int = RADIUS,
+    n_players: int = N_PLAYERS,
+    seed: Optional[int] = None,
+    budget: int = BUDGET,
+) -> Game:
+    # one city per player, spread evenly on a ring half way to the border
+    seed = getrandbits(32) if seed is None else seed
+    board = HexBoard.build_circular(radius, seed=seed)
+    ring = list(HexCoord(0, 0, 0).ring(max(1, radius // 2)))
+    cities = [
+        City(
+            location=ring[i * len(ring) // n_players],
+            owner_id=i,
+            id=i,
+            name=str(i),
+            workers=[],
+            actions=1,
+        )
+        for i in range(n_players)
+    ]
+    game = Game.build_empty(
+        board=board,
+        players=[Player(id=i, budget=budget) for i in range(n_players)],
+        seed=seed,
+    )
+    game.cities = cities
+    game.reindex()
+    return game
+
+
+def random_policy(
+    game: Game, actions: List[Action], rng: np.random.Generator
+) -> Action:
+    # attack whenever possible, any other legal action otherwise
+    attacks = [a for a in actions if a.action_type == ActionType.attack]
+    if attacks:
+        actions = attacks
+    return actions[int(rng.random() * len(actions))]
+
+
+def play_game(
+    game: Game,
+    policy: Policy = random_policy,
+    max_turns: int = MAX_TURNS,
+    rng: Optional[np.random.Generator] = None,
+) -> GameResult:
+    # play in memory until max_turns rounds are over, the winner is the
+    # player with the most units left
+    rng = rng or game.rng
+    units_built: Counter = Counter()
+    units_lost: Counter = Counter()
+    n_actions = 0
+    turns = 0
+    while turns < max_turns:
+        player_id = game.current_player.id
+        action = policy(game, legal_actions(game, player_id), rng)
+        if action.action_type == ActionType.attack:
+            attacked_unit = game.unit_from_id(action.params.attacked_unit_id)
+        apply_action(game, action)
+        n_actions += 1
+
+        if action.action_type == ActionType.build_unit:
+            units_built[action.params.type.value] += 1
+        elif action.action_type == ActionType.attack:
+            if attacked_unit not in game.units:
+                units_lost[attacked_unit.type.value] += 1
+        elif (
+            action.action_type == ActionType.end_turn
+            and game.current_player_idx == 0
+        ):
+            turns += 1
+
+    units_alive = Counter(unit.owner_id for unit in game.units)
+    ranking = units_alive.most_common(2)
+    if not ranking or (len(ranking) == 2 and ranking[0][1] == ranking[1][1]):
+        winner_id = None
+    else:
+        winner_id = ranking[0][0]
+    return GameResult(
+        seed=game.seed,
+        turns=turns,
+        actions=n_actions,
+        winner_id=winner_id,
+        units_alive={p.id: units_alive[p.id] for p in game.players},
+        units_built=dict(units_built),
+        units_lost=dict(units_lost),
+    )
+
+
+def simulate(
+    seed: int,
+    radius: int = RADIUS,
+    n_players: int = N_PLAYERS,
+    max_turns: int = MAX_TURNS,
+) -> GameResult:
+    return play_game(
+        setup_game(radius=radius, n_players=n_players, seed=seed),
+        max_turns=max_turns,
+    )
+
+
+def _simulate_args(args) -> GameResult:
+    return simulate(*args)
+
+
+def run_batch(
+    n_games: int,
+    n_workers: Optional[int] = None,
+    radius: int = RADIUS,
+    n_players: int = N_PLAYERS,
+    max_turns: int = MAX_TURNS,
+    seed: int = 0,
+) -> BatchReport:
+    # games are seeded seed, seed + 1, ..., so a batch can be reproduced.
+    # n_workers=0 plays all the games in this process
+    args = [(seed + i, radius, n_players, max_turns) for i in range(n_games)]
+    start = time.perf_counter()
+    if n_workers == 0:
+        results = [_simulate_args(a) for a in args]
+    else:
+        n_workers = n_workers or os.cpu_count() or 1
+        chunksize = max(1, n_games // (4 * n_workers))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(
+                executor.map(_simulate_args, args, chunksize=chunksize)
+            )
+    seconds = time.perf_counter() - start
+    return batch_report(results, seconds)
+
+
+def batch_report(results: List[GameResult], seconds: float) -> BatchReport:
+    wins: Counter = Counter()
+    units_built: Counter = Counter()
+    units_lost: Counter = Counter()
+    for result in results:
+        if result.winner_id is not None:
+            wins[result.winner_id] += 1
+        units_built.update(result.units_built)
+        units_lost.update(result.units_lost)
+    n_games = len(results)
+    total_actions = sum(result.actions for result in results)
+    return BatchReport(
+        games=n_games,
+        seconds=seconds,
+        games_per_second=n_games / seconds if seconds else 0.0,
+        actions_per_second=total_actions / seconds if seconds else 0.0,
+        wins=dict(sorted(wins.items())),
+        draws=n_games - sum(wins.values()),
+        mean_turns=(
+            sum(result.turns for result in results) / n_games
+            if n_games
+            else 0.0
+        ),
+        mean_actions=total_actions / n_games if n_games else 0.0,
+        units_built=dict(units_built),
+        units_lost=dict(units_lost),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Play random games in memory and report statistics"
+    )
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--radius", type=int, default=RADIUS)
+    parser.add_argument("--players", type=int, default=N_PLAYERS)
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    report = run_batch(
+        n_games=args.games,
+        n_workers=args.workers,
+        radius=args.radius,
+        n_players=args.players,
+        max_turns=args.max_turns,
+        seed=args.seed,
+    )
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
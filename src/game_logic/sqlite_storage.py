@@ -0,0 +1,207 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from src.game_logic.game import Game
+from src.game_logic.metrics import timed_phase
+from src.game_logic.serialization import get_serializer
+from src.game_logic.storage import GAMES_DIR, LIST_LIMIT, GameInfo, Storage
+
+DB_NAME = "games.sqlite3"
+POOL_SIZE = 4
+BUSY_TIMEOUT = 5.0
+
+# Placeholder rows, with a NULL snapshot, are ids allocated by new_id for
+# games not saved yet. The listing index only covers saved games.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    data BLOB,
+    version INTEGER NOT NULL DEFAULT 0,
+    n_players INTEGER NOT NULL DEFAULT 0,
+    current_player_id INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS games_updated_at
+    ON games (updated_at) WHERE data IS NOT NULL;
+"""
+
+# Constant statements with parameters, prepared once per connection and
+# then reused from its statement cache.
+EXISTS = "SELECT 1 FROM games WHERE id = ? AND data IS NOT NULL"
+LOAD = "SELECT data FROM games WHERE id = ? AND data IS NOT NULL"
+SAVE = """
+INSERT INTO games (
+    id, data, version, n_players, current_player_id, updated_at, revision
+)
+VALUES (?, ?, ?, ?, ?, ?, 1)
+ON CONFLICT (id) DO UPDATE SET
+    data = excluded.data,
+    version = excluded.version,
+    n_players = excluded.n_players,
+    current_player_id = excluded.current_player_id,
+    updated_at = excluded.updated_at,
+    revision = games.revision + 1
+"""
+# one statement, so that concurrent writers cannot get the same id
+NEW_ID = """
+INSERT INTO games (id, updated_at)
+SELECT COALESCE(MAX(id) + 1, 0), ? FROM games
+RETURNING id
+"""
+# the row stays, so that the id is not reused and the revision keeps counting
+DELETE = "UPDATE games SET data = NULL, revision = revision + 1 WHERE id = ?"
+GAME_IDS = "SELECT id FROM games WHERE data IS NOT NULL"
+REVISION = "SELECT revision FROM games WHERE id = ?"
+LIST = """
+SELECT id, version, n_players, current_player_id, updated_at FROM games
+WHERE data IS NOT NULL AND (updated_at, id) < (?, ?)
+ORDER BY updated_at DESC, id DESC
+LIMIT ?
+"""
+
+
+class SqliteStorage(Storage):
+    """Games stored as snapshots in a SQLite database, with their metadata.
+
+    The database, file_dir/games.sqlite3, is in WAL mode so that readers
+    do not wait for the writer, also across processes. Lookups go through
+    the primary key and listings through the updated_at index, ids are
+    allocated by the database. Connections are pooled, up to pool_size.
+    """
+
+    def __init__(
+        self,
+        file_dir: str = GAMES_DIR,
+        trusted: bool = True,
+        pool_size: int = POOL_SIZE,
+    ):
+        super().__init__(file_dir)
+        self.trusted = trusted
+        self.path = os.path.join(file_dir, DB_NAME)
+        self.pool_size = pool_size
+        self._connections: queue.LifoQueue = queue.LifoQueue()
+        self._n_connections = 0
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit, each statement is a transaction
+        connection = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._n_connections < self.pool_size
+                if create:
+                    self._n_connections += 1
+            connection = self._connect() if create else self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self) -> None:
+        # closes the idle connections
+        while True:
+            try:
+                connection = self._connections.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
+            with self._lock:
+                self._n_connections -= 1
+
+    def exists(self, game_id: int) -> bool:
+        with self._connection() as connection:
+            return (
+                connection.execute(EXISTS, (game_id,)).fetchone() is not None
+            )
+
+    def load(self, game_id: int) -> Game:
+        with timed_phase("read"), self._connection() as connection:
+            row = connection.execute(LOAD, (game_id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Game {game_id} not found in {self.path}")
+        with timed_phase("decode"):
+            game_dict = get_serializer().loads(row[0])
+        with timed_phase("validate"):
+            if self.trusted:
+                return Game.from_trusted_dict(game_dict)
+            return Game(**game_dict)
+
+    def save(self, game_id: int, game: Game) -> None:
+        info = GameInfo.from_game(game_id, game, time.time())
+        with timed_phase("encode"):
+            data = game.to_packed_json(include_rng=True)
+        with timed_phase("write"), self._connection() as connection:
+            connection.execute(
+                SAVE,
+                (
+                    game_id,
+                    data,
+                    info.version,
+                    info.n_players,
+                    info.current_player_id,
+                    info.updated_at,
+                ),
+            )
+
+    def delete(self, game_id: int) -> None:
+        with self._connection() as connection:
+            connection.execute(DELETE, (game_id,))
+
+    def game_ids(self) -> Iterator[int]:
+        with self._connection() as connection:
+            for (game_id,) in connection.execute(GAME_IDS):
+                yield game_id
+
+    def new_id(self) -> int:
+        with self._connection() as connection:
+            # fetched to the end, so that the insert completes
+            ((game_id,),) = connection.execute(
+                NEW_ID, (time.time(),)
+            ).fetchall()
+        return game_id
+
+    def revision(self, game_id: int) -> int:
+        with self._connection() as connection:
+            row = connection.execute(REVISION, (game_id,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def list_games(
+        self,
+        limit: int = LIST_LIMIT,
+        before: Optional[float] = None,
+        before_id: Optional[int] = None,
+    ) -> List[GameInfo]:
+        if before is None:
+            before = float("inf")
+        # ids are never negative
+        if before_id is None:
+            before_id = -1
+        with self._connection() as connection:
+            rows = connection.execute(
+                LIST, (before, before_id, limit)
+            ).fetchall()
+        # columns in the order of the GameInfo fields
+        return [
+            GameInfo(**dict(zip(GameInfo.model_fields, row))) for row in rows
+        ]
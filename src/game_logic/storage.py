@@ -0,0 +1,411 @@
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager, contextmanager
+from os import listdir
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from pydantic import BaseModel
+
+from src.game_logic.exceptions import GameConflictException
+from src.game_logic.game import Game
+from src.game_logic.metrics import timed_phase
+from src.game_logic.serialization import get_serializer
+
+logger = logging.getLogger(__name__)
+
+GAMES_DIR = "data/games"
+SNAPSHOT_EVERY = 50
+LOCK_TIMEOUT = 5.0
+LOCK_POLL_INTERVAL = 0.001
+LIST_LIMIT = 100
+
+
+class GameInfo(BaseModel):
+    # metadata of a stored game, for listings
+    id: int
+    version: int
+    n_players: int
+    current_player_id: int
+    # seconds since the epoch
+    updated_at: float
+
+    @classmethod
+    def from_game(
+        cls, game_id: int, game: Game, updated_at: float
+    ) -> "GameInfo":
+        return cls(
+            id=game_id,
+            version=game.version,
+            n_players=len(game.players),
+            current_player_id=game.players[game.current_player_idx].id,
+            updated_at=updated_at,
+        )
+
+
+class Storage(ABC):
+    """Where the session store persists games.
+
+    Storages shared by several processes are locked game by game with flock
+    on NNN.lock files in file_dir. A process caching a game reloads it when
+    the revision of the stored game, bumped by every write, moved on.
+    """
+
+    def __init__(self, file_dir: str = GAMES_DIR):
+        self.file_dir = file_dir
+
+    @abstractmethod
+    def exists(self, game_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def load(self, game_id: int) -> Game:
+        # raises FileNotFoundError for unknown games
+        ...
+
+    @abstractmethod
+    def save(self, game_id: int, game: Game) -> None:
+        ...
+
+    def append(self, game_id: int, game: Game, record: Dict) -> bool:
+        # the whole game is written by save, returns whether the game is
+        # persisted after the call
+        return False
+
+    @abstractmethod
+    def delete(self, game_id: int) -> None:
+        # the id stays taken, and the revision keeps counting
+        ...
+
+    @abstractmethod
+    def new_id(self) -> int:
+        # atomically allocates the id of a new game, across processes
+        ...
+
+    @abstractmethod
+    def game_ids(self) -> Iterator[int]:
+        # streams the ids of the stored games
+        ...
+
+    @abstractmethod
+    def revision(self, game_id: int) -> int:
+        ...
+
+    @abstractmethod
+    def list_games(
+        self,
+        limit: int = LIST_LIMIT,
+        before: Optional[float] = None,
+        before_id: Optional[int] = None,
+    ) -> List[GameInfo]:
+        # most recently updated games first, then by decreasing id. Pages
+        # follow (before, before_id), the updated_at and id of the last game
+        # of the previous page; without before_id, games updated at before
+        # are left out
+        ...
+
+    def maintain(self) -> None:
+        # called periodically by the session store
+        pass
+
+    def lock_path(self, game_id: int) -> str:
+        return os.path.join(self.file_dir, f"{game_id:03}.lock")
+
+    def try_lock(self, game_id: int) -> Optional[int]:
+        # file descriptor holding the lock, None if the game is locked. Each
+        # call opens the file again, so that threads exclude each other too
+        fd = os.open(self.lock_path(game_id), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def unlock(self, fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    @contextmanager
+    def lock(
+        self, game_id: int, timeout: float = LOCK_TIMEOUT
+    ) -> Iterator[None]:
+        # flock cannot time out, it is polled instead
+        deadline = time.monotonic() + timeout
+        while (fd := self.try_lock(game_id)) is None:
+            if time.monotonic() > deadline:
+                raise GameConflictException(f"Game {game_id} is busy")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self.unlock(fd)
+
+
+def _list_cursor(
+    before: Optional[float], before_id: Optional[int]
+) -> Tuple[float, float]:
+    # games listed have (updated_at, id) lower than the cursor
+    return (
+        float("inf") if before is None else before,
+        float("-inf") if before_id is None else before_id,
+    )
+
+
+class FileStorage(Storage):
+    # One json file per game, named after the zero padded game id. Games
+    # are loaded without validation unless trusted is False, e.g. for files
+    # that were not written by a FileStorage. The revision of a game is
+    # kept in its lock file.
+    def __init__(self, file_dir: str = GAMES_DIR, trusted: bool = True):
+        super().__init__(file_dir)
+        self.trusted = trusted
+
+    def path(self, game_id: int) -> str:
+        return os.path.join(self.file_dir, f"{game_id:03}.json")
+
+    def claim(self, game_id: int) -> bool:
+        # atomically takes a new game id, across processes
+        try:
+            os.close(
+                os.open(
+                    self.lock_path(game_id), os.O_RDWR | os.O_CREAT | os.O_EXCL
+                )
+            )
+        except FileExistsError:
+            return False
+        return True
+
+    def revision(self, game_id: int) -> int:
+        try:
+            with open(self.lock_path(game_id), "rb") as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _bump_revision(self, game_id: int) -> None:
+        # called by the writes, while the game is locked
+        fd = os.open(self.lock_path(game_id), os.O_RDWR | os.O_CREAT)
+        try:
+            revision = int(os.pread(fd, 32, 0) or 0) + 1
+            data = str(revision).encode()
+            os.pwrite(fd, data, 0)
+            os.ftruncate(fd, len(data))
+        finally:
+            os.close(fd)
+
+    def exists(self, game_id: int) -> bool:
+        return os.path.exists(self.path(game_id))
+
+    def load(self, game_id: int) -> Game:
+        with timed_phase("read"):
+            with open(self.path(game_id), "rb") as f:
+                data = f.read()
+        with timed_phase("decode"):
+            game_dict = get_serializer().loads(data)
+        with timed_phase("validate"):
+            if self.trusted:
+                return Game.from_trusted_dict(game_dict)
+            return Game(**game_dict)
+
+    def save(self, game_id: int, game: Game) -> None:
+        # write to a temporary file first, so that a crash mid-write never
+        # leaves a truncated game behind
+        filename = self.path(game_id)
+        tmp_filename = f"{filename}.tmp"
+        with timed_phase("encode"):
+            data = game.to_packed_json(include_rng=True)
+        with timed_phase("write"):
+            with open(tmp_filename, "wb") as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+            self._bump_revision(game_id)
+
+    def delete(self, game_id: int) -> None:
+        try:
+            os.remove(self.path(game_id))
+        except FileNotFoundError:
+            return
+        self._bump_revision(game_id)
+
+    def updated_at(self, game_id: int) -> float:
+        return os.path.getmtime(self.path(game_id))
+
+    def game_ids(self) -> Iterator[int]:
+        with os.scandir(self.file_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    yield int(entry.name[:-5])
+
+    def new_id(self) -> int:
+        # scans the directory, see SqliteStorage for large numbers of games
+        game_id = 0
+        for file_path in listdir(self.file_dir):
+            if not file_path.endswith(".json"):
+                continue
+            game_id = max(int(file_path[:-5]) + 1, game_id)
+        while not self.claim(game_id):
+            game_id += 1
+        return game_id
+
+    def list_games(
+        self,
+        limit: int = LIST_LIMIT,
+        before: Optional[float] = None,
+        before_id: Optional[int] = None,
+    ) -> List[GameInfo]:
+        # scans the directory and loads the games listed
+        cursor = _list_cursor(before, before_id)
+        updated = []
+        for game_id in self.game_ids():
+            updated_at = self.updated_at(game_id)
+            if (updated_at, game_id) < cursor:
+                updated.append((updated_at, game_id))
+        updated.sort(reverse=True)
+        return [
+            GameInfo.from_game(game_id, self.load(game_id), updated_at)
+            for updated_at, game_id in updated[:limit]
+        ]
+
+
+class ActionLogStorage(FileStorage):
+    """Persists games as a snapshot plus an append-only log of actions.
+
+    The snapshot keeps the existing NNN.json layout, the log NNN.log holds
+    one json record per action applied after it. A new snapshot is written
+    every `snapshot_every` actions, loading replays the log on top of the
+    latest snapshot.
+    """
+
+    def __init__(
+        self,
+        file_dir: str = GAMES_DIR,
+        replay: Optional[Callable[[Game, Dict], None]] = None,
+        snapshot_every: int = SNAPSHOT_EVERY,
+        trusted: bool = True,
+    ):
+        super().__init__(file_dir, trusted=trusted)
+        self.replay = replay
+        self.snapshot_every = snapshot_every
+        self._snapshot_versions: Dict[int, int] = {}
+
+    def log_path(self, game_id: int) -> str:
+        return os.path.join(self.file_dir, f"{game_id:03}.log")
+
+    def load(self, game_id: int) -> Game:
+        game = super().load(game_id)
+        self._snapshot_versions[game_id] = game.version
+        if not os.path.exists(self.log_path(game_id)):
+            return game
+        truncated = False
+        serializer = get_serializer()
+        with timed_phase("replay"), open(self.log_path(game_id), "rb") as f:
+            for line in f:
+                try:
+                    record = serializer.loads(line)
+                except ValueError:
+                    # only the last record can be partially written
+                    truncated = True
+                    break
+                # records older than the snapshot are left over from a crash
+                # between the snapshot and the log truncation
+                if record["version"] <= game.version:
+                    continue
+                self.replay(game, record)
+                assert game.version == record["version"]
+        if truncated:
+            # snapshot right away, new records must not follow the broken one
+            logger.warning(f"Ignoring truncated log record of game {game_id}")
+            self.save(game_id, game)
+        elif game.rng_state is None:
+            # the snapshot has no dice generator, persist the one just
+            # created, otherwise replaying would roll different dice
+            self.save(game_id, game)
+        return game
+
+    def save(self, game_id: int, game: Game) -> None:
+        super().save(game_id, game)
+        with open(self.log_path(game_id), "w"):
+            pass
+        self._snapshot_versions[game_id] = game.version
+
+    def updated_at(self, game_id: int) -> float:
+        # the snapshot is only written every snapshot_every actions
+        try:
+            log_updated_at = os.path.getmtime(self.log_path(game_id))
+        except FileNotFoundError:
+            log_updated_at = 0.0
+        return max(super().updated_at(game_id), log_updated_at)
+
+    def delete(self, game_id: int) -> None:
+        super().delete(game_id)
+        try:
+            os.remove(self.log_path(game_id))
+        except FileNotFoundError:
+            pass
+        self._snapshot_versions.pop(game_id, None)
+
+    def append(self, game_id: int, game: Game, record: Dict) -> bool:
+        # without a snapshot, e.g. deleted meanwhile, a log would be lost
+        snapshot_version = self._snapshot_versions.get(game_id)
+        if (
+            snapshot_version is None
+            or game.version - snapshot_version >= self.snapshot_every
+            or not self.exists(game_id)
+        ):
+            self.save(game_id, game)
+        else:
+            with timed_phase("write"):
+                with open(self.log_path(game_id), "ab") as f:
+                    f.write(get_serializer().dumps_data(record) + b"\n")
+                self._bump_revision(game_id)
+        return True
+
+
+class ThreadedStorage:
+    """Async interface to a storage, running its blocking calls in threads."""
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    async def exists(self, game_id: int) -> bool:
+        return await asyncio.to_thread(self.storage.exists, game_id)
+
+    async def load(self, game_id: int) -> Game:
+        return await asyncio.to_thread(self.storage.load, game_id)
+
+    async def save(self, game_id: int, game: Game) -> None:
+        await asyncio.to_thread(self.storage.save, game_id, game)
+
+    async def append(self, game_id: int, game: Game, record: Dict) -> bool:
+        return await asyncio.to_thread(
+            self.storage.append, game_id, game, record
+        )
+
+    async def new_id(self) -> int:
+        return await asyncio.to_thread(self.storage.new_id)
+
+    @asynccontextmanager
+    async def lock(
+        self, game_id: int, timeout: float = LOCK_TIMEOUT
+    ) -> AsyncIterator[None]:
+        deadline = time.monotonic() + timeout
+        while (fd := self.storage.try_lock(game_id)) is None:
+            if time.monotonic() > deadline:
+                raise GameConflictException(f"Game {game_id} is busy")
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self.storage.unlock(fd)
@@ -1,24 +1,69 @@
-from typing import List
+from typing import List, Optional
 
-from perlin_noise import PerlinNoise
+import numpy as np
 
 OCTAVES = 3
 THRESHOLDS = [-0.2, 0, 0.2]
+# distance between two cells in noise space
+CELL_SCALE = 1 / 10
 
 
-def generate_world(width: int, height: int):
-    noise = PerlinNoise(octaves=OCTAVES)
-    noise_discrete = [
-        [noise([i / 10, j / 10]) for j in range(width)] for i in range(height)
-    ]
+def perlin_noise(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    octaves: float = OCTAVES,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    # Gradient noise on the grid of points xs x ys, same algorithm as the
+    # perlin-noise package: a random gradient with components in [-1, 1] on
+    # every integer corner, weighted with the fade curve.
+    xs = np.asarray(xs, dtype=float) * octaves
+    ys = np.asarray(ys, dtype=float) * octaves
+    x0 = np.floor(xs).astype(int)
+    y0 = np.floor(ys).astype(int)
 
-    def digitalize(elem: float, thresholds: List[float]):
-        for i, th in enumerate(thresholds):
-            if elem <= th:
-                return i
-        return len(thresholds)
+    rng = np.random.default_rng(seed)
+    x_min, y_min = x0.min(), y0.min()
+    gradients = rng.uniform(
+        -1, 1, size=(x0.max() - x_min + 2, y0.max() - y_min + 2, 2)
+    )
 
-    return [
-        [digitalize(elem, THRESHOLDS) for elem in row]
-        for row in noise_discrete
-    ]
+    # everything below has shape (len(xs), len(ys))
+    dx = (xs - x0)[:, None]
+    dy = (ys - y0)[None, :]
+    gx = (x0 - x_min)[:, None]
+    gy = (y0 - y_min)[None, :]
+
+    noise = np.zeros((len(xs), len(ys)))
+    for cx in [0, 1]:
+        for cy in [0, 1]:
+            gradient = gradients[gx + cx, gy + cy]
+            dist_x = dx - cx
+            dist_y = dy - cy
+            weight = _fade(1 - np.abs(dist_x)) * _fade(1 - np.abs(dist_y))
+            noise += weight * (
+                gradient[..., 0] * dist_x + gradient[..., 1] * dist_y
+            )
+    return noise
+
+
+def _fade(t: np.ndarray) -> np.ndarray:
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def generate_world(
+    width: int,
+    height: int,
+    seed: Optional[int] = None,
+    octaves: float = OCTAVES,
+    thresholds: List[float] = THRESHOLDS,
+) -> np.ndarray:
+    # terrain level of each cell, from 0 to len(thresholds), as an array of
+    # shape (height, width)
+    noise = perlin_noise(
+        np.arange(height) * CELL_SCALE,
+        np.arange(width) * CELL_SCALE,
+        octaves=octaves,
+        seed=seed,
+    )
+    return np.digitize(noise, thresholds, right=True)
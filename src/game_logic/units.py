@@ -1,12 +1,18 @@
 import json
+import logging
+import os
 from enum import Enum
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 from src.game_logic.board import HexBoard, HexCoord
 from src.game_logic.dice import DiceSet
 from src.game_logic.exceptions import IllegalActionException
 
+logger = logging.getLogger(__name__)
+
 
 class UnitType(Enum):
     warrior = "warrior"
@@ -16,10 +22,11 @@ class UnitType(Enum):
     catapult = "catapult"
 
 
-stats_dict = json.load(open("src/game_logic/units_stats.json"))
+UNIT_STATS_PATH = os.path.join(os.path.dirname(__file__), "units_stats.json")
 
 
 class UnitStats(BaseModel):
+    model_config = ConfigDict(frozen=True)
     type: UnitType
     cost: int
     attack_melee: DiceSet
@@ -30,18 +37,18 @@ class UnitStats(BaseModel):
 
     @staticmethod
     def from_type(type: UnitType) -> "UnitStats":
+        return unit_stats[type]
+
+    @staticmethod
+    def from_dict(type: UnitType, stats: Dict[str, Any]) -> "UnitStats":
         return UnitStats(
             type=type,
-            cost=stats_dict[type.value]["cost"],
-            attack_melee=DiceSet.from_dice_code(
-                stats_dict[type.value]["attack_melee"]
-            ),
-            attack_ranged=DiceSet.from_dice_code(
-                stats_dict[type.value]["attack_ranged"]
-            ),
-            defense=DiceSet.from_dice_code(stats_dict[type.value]["defense"]),
-            movement=stats_dict[type.value]["movement"],
-            range=stats_dict[type.value]["range"],
+            cost=stats["cost"],
+            attack_melee=DiceSet.from_dice_code(stats["attack_melee"]),
+            attack_ranged=DiceSet.from_dice_code(stats["attack_ranged"]),
+            defense=DiceSet.from_dice_code(stats["defense"]),
+            movement=stats["movement"],
+            range=stats["range"],
         )
 
     def __eq__(self, __value: object) -> bool:
@@ -57,6 +64,31 @@ class UnitStats(BaseModel):
         return True
 
 
+def load_unit_stats(
+    path: str = UNIT_STATS_PATH,
+) -> Mapping[UnitType, UnitStats]:
+    with open(path) as f:
+        stats_dict = json.load(f)
+    missing_types = [t.value for t in UnitType if t.value not in stats_dict]
+    if missing_types:
+        raise ValueError(f"Missing stats for unit types {missing_types}")
+    return MappingProxyType(
+        {t: UnitStats.from_dict(t, stats_dict[t.value]) for t in UnitType}
+    )
+
+
+def reload_unit_stats(path: str = UNIT_STATS_PATH) -> None:
+    # the whole registry is replaced at once, so that a unit never sees a
+    # mix of old and new stats. A broken file leaves the current stats
+    global unit_stats
+    unit_stats = load_unit_stats(path)
+    logger.info("Reloaded unit stats from %s", path)
+
+
+# built once, the stats are shared by all the units of the same type
+unit_stats = load_unit_stats()
+
+
 class Unit(BaseModel):
     location: HexCoord
     owner_id: int
@@ -79,15 +111,22 @@ class Unit(BaseModel):
 
     @property
     def stats(self) -> UnitStats:
-        return UnitStats.from_type(self.type)
-
-    def move_to(self, to: HexCoord, board: HexBoard) -> None:
-        if self.location.distance(to) > self.actions:
+        return unit_stats[self.type]
+
+    def move_to(
+        self, to: HexCoord, board: HexBoard, cost: Optional[int] = None
+    ) -> None:
+        # cost of the path, see Game.move_unit for moves following the
+        # terrain. Defaults to the straight distance
+        if cost is None:
+            cost = self.location.distance(to)
+        if cost > self.actions:
             raise IllegalActionException(
-                f"Unit {self.id} cannot move: only {self.actions} actions left"
+                f"Unit {self.id} cannot move: "
+                f"only {self.actions} actions left",
+                reason="no_actions_left",
             )
-        # TODO: add physics, now can move on see or through mountains
-        self.actions -= self.location.distance(to)
+        self.actions -= cost
         self.location = to
 
 
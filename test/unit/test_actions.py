@@ -1,17 +1,33 @@
 import json
 import os
+import pickle
 import tempfile
 from typing import Dict
 
+import numpy as np
 import pytest
 from pydantic import ValidationError
 
-from src.game_logic.actions import Action, take_action
+from src.game_logic.actions import (
+    ACTIONS_TAKEN,
+    ILLEGAL_ACTIONS,
+    Action,
+    action_log_storage,
+    apply_action,
+    take_action,
+    take_action_delta,
+)
 from src.game_logic.board import HexBoard, HexCoord
 from src.game_logic.city import City
-from src.game_logic.exceptions import IllegalActionException
+from src.game_logic.delta import GameDelta, delta_history
+from src.game_logic.exceptions import (
+    GameConflictException,
+    IllegalActionException,
+)
 from src.game_logic.game import Game
+from src.game_logic.metrics import PHASE_SECONDS, timed_operation
 from src.game_logic.player import Player
+from src.game_logic.session import get_game
 from src.game_logic.units import Unit, UnitType, Worker
 
 action_list = [
@@ -136,7 +152,8 @@ action_list = [
 @pytest.fixture
 def temporary_directory_with_game():
     game = Game(
-        board=HexBoard.build_circular(10),
+        # plain cells only, moves cost their distance
+        board=HexBoard.build_circular(10, thresholds=[-1.0, 1.0, 1.0]),
         players=[Player(id=idx, budget=10) for idx in range(4)],
         units=[
             Unit(
@@ -222,3 +239,246 @@ def test_action_request_validation(
             print(e)
             print("DONE")
         assert not valid
+
+
+def test_action_log_replay(temporary_directory_with_game):
+    storage = action_log_storage(
+        os.path.join(temporary_directory_with_game, "games")
+    )
+    storage.snapshot_every = 3
+    game = storage.load(0)
+    actions = [
+        serialized_action.values[0]
+        for serialized_action in action_list
+        if serialized_action.values[1]
+    ] + [
+        {
+            "action_type": "end_turn",
+            "params": {"game_id": 0, "player_id": player_id},
+        }
+        for player_id in range(1, 4)
+    ]
+    for serialized_action in actions * 2:
+        action = Action(**serialized_action)
+        try:
+            apply_action(game, action)
+        except IllegalActionException:
+            continue
+        storage.append(
+            0, game, {"version": game.version, "action": serialized_action}
+        )
+    assert game.version > storage.snapshot_every
+
+    game2 = action_log_storage(storage.file_dir).load(0)
+    assert game2.version == game.version
+    assert game2 == game
+
+    assert game2.rng.random() == game.rng.random()
+
+
+def apply_delta(game_dict: Dict, delta: GameDelta) -> None:
+    # what a client does with the deltas
+    delta_dict = delta.model_dump(mode="json")
+    assert game_dict["version"] == delta_dict["from_version"]
+    for key, removed_ids in [("units", delta_dict["removed_unit_ids"])] + [
+        ("cities", []),
+        ("players", []),
+    ]:
+        by_id = {item["id"]: item for item in game_dict[key]}
+        by_id.update((item["id"], item) for item in delta_dict[key])
+        game_dict[key] = [
+            item for id, item in by_id.items() if id not in removed_ids
+        ]
+    game_dict["version"] = delta_dict["version"]
+    game_dict["current_player_idx"] = delta_dict["current_player_idx"]
+
+
+def test_action_deltas(temporary_directory_with_game):
+    file_dir = os.path.join(temporary_directory_with_game, "games")
+    game = get_game(0, file_dir=file_dir)
+    client_game = game.model_dump(mode="json")
+    client_games = {0: json.loads(json.dumps(client_game))}
+    actions = [
+        serialized_action.values[0]
+        for serialized_action in action_list
+        if serialized_action.values[1]
+    ] + [
+        {
+            "action_type": "end_turn",
+            "params": {"game_id": 0, "player_id": player_id},
+        }
+        for player_id in range(1, 4)
+    ]
+    for serialized_action in actions * 2:
+        try:
+            delta = take_action_delta(
+                Action(**serialized_action), file_dir=file_dir
+            )
+        except IllegalActionException:
+            continue
+        apply_delta(client_game, delta)
+        assert client_game == game.model_dump(mode="json")
+        client_games[game.version] = json.loads(json.dumps(client_game))
+    assert game.version > 2
+
+    # a client that fell behind catches up in one go
+    history = delta_history(game)
+    for version in client_games:
+        client_game = client_games[version]
+        apply_delta(client_game, history.since(game, version))
+        assert client_game == game.model_dump(mode="json")
+    assert history.since(game, game.version + 1) is None
+
+
+def test_expected_version(temporary_directory_with_game):
+    file_dir = os.path.join(temporary_directory_with_game, "games")
+    game = get_game(0, file_dir=file_dir)
+    params = {"game_id": 0, "player_id": 0, "expected_version": 1}
+    with pytest.raises(GameConflictException):
+        take_action(Action(action_type="end_turn", params=params), file_dir)
+    assert game.version == 0
+
+    params["expected_version"] = 0
+    take_action(Action(action_type="end_turn", params=params), file_dir)
+    assert game.version == 1
+
+
+def test_action_metrics(temporary_directory_with_game):
+    file_dir = os.path.join(temporary_directory_with_game, "games")
+    taken = ACTIONS_TAKEN.value("end_turn")
+    illegal = ILLEGAL_ACTIONS.value("end_turn", "not_current_player")
+
+    with timed_operation("test_action_metrics"):
+        take_action(
+            Action(
+                action_type="end_turn",
+                params={"game_id": 0, "player_id": 0},
+            ),
+            file_dir,
+        )
+        with pytest.raises(IllegalActionException) as e:
+            take_action(
+                Action(
+                    action_type="end_turn",
+                    params={"game_id": 0, "player_id": 0},
+                ),
+                file_dir,
+            )
+    assert ACTIONS_TAKEN.value("end_turn") == taken + 1
+    assert (
+        ILLEGAL_ACTIONS.value("end_turn", "not_current_player") == illegal + 1
+    )
+    # the first action loaded the game
+    for phase, count in [
+        ("acquire", 2),
+        ("read", 1),
+        ("validate", 1),
+        ("rules", 2),
+        ("append", 1),
+    ]:
+        assert PHASE_SECONDS.count("test_action_metrics", phase) == count
+
+    # the reason is kept across processes, e.g. from the shards
+    assert pickle.loads(pickle.dumps(e.value)).reason == "not_current_player"
+
+
+def test_action_log_replay_new_ids(temporary_directory_with_game):
+    # ids given after a unit is removed must be the same when replayed on
+    # a snapshot taken after the removal
+    storage = action_log_storage(
+        os.path.join(temporary_directory_with_game, "games")
+    )
+    game = storage.load(0)
+    game.remove_unit(game.unit_from_id(3))
+    storage.save(0, game)
+
+    actions = [
+        {
+            "action_type": "build_unit",
+            "params": {
+                "game_id": 0,
+                "player_id": 0,
+                "city_id": 0,
+                "type": "warrior",
+            },
+        }
+    ] + [
+        {
+            "action_type": "end_turn",
+            "params": {"game_id": 0, "player_id": player_id},
+        }
+        for player_id in range(4)
+    ]
+    for serialized_action in actions:
+        action = Action(**serialized_action)
+        apply_action(game, action)
+        record = {
+            "version": game.version,
+            "action": action.model_dump(mode="json"),
+        }
+        storage.append(0, game, record)
+    new_unit = game.unit_from_location(HexCoord(q=-2, r=-1, s=3))
+    action = Action(
+        action_type="move_unit",
+        params={
+            "game_id": 0,
+            "player_id": 0,
+            "unit_id": new_unit.id,
+            "move_to": {"q": -2, "r": 0, "s": 2},
+        },
+    )
+    apply_action(game, action)
+    record = {
+        "version": game.version,
+        "action": action.model_dump(mode="json"),
+    }
+    storage.append(0, game, record)
+
+    assert storage.load(0) == game
+
+
+def test_attack_advance():
+    # of several winning melee attackers, only the first one advances
+    for seed in range(20):
+        game = Game.build_empty(
+            board=HexBoard.build_circular(3, thresholds=[-1.0, 1.0, 1.0]),
+            players=[Player(id=idx, budget=10) for idx in range(2)],
+        )
+        for unit_id, location, owner_id, unit_type in [
+            (0, HexCoord(q=0, r=0, s=0), 1, UnitType.warrior),
+            (1, HexCoord(q=1, r=0, s=-1), 0, UnitType.knight),
+            (2, HexCoord(q=0, r=1, s=-1), 0, UnitType.knight),
+        ]:
+            game.add_unit(
+                Unit(
+                    location=location,
+                    owner_id=owner_id,
+                    id=unit_id,
+                    type=unit_type,
+                    actions=1,
+                )
+            )
+        action = Action(
+            action_type="attack",
+            params={
+                "game_id": 0,
+                "player_id": 0,
+                "attacking_unit_ids": [1, 2],
+                "attacked_unit_id": 0,
+            },
+        )
+        apply_action(game, action, np.random.default_rng(seed))
+        if all(unit.id != 0 for unit in game.units):
+            break
+    else:
+        pytest.fail("The attack never won")
+
+    assert game.unit_from_id(1).location == HexCoord(q=0, r=0, s=0)
+    assert game.unit_from_id(2).location == HexCoord(q=0, r=1, s=-1)
+    assert game.unit_from_location(HexCoord(q=0, r=0, s=0)).id == 1
+    assert game.unit_from_location(HexCoord(q=0, r=1, s=-1)).id == 2
+    assert game.unit_from_location(HexCoord(q=1, r=0, s=-1)) is None
+
+    # and moving into an occupied cell is rejected
+    with pytest.raises(IllegalActionException):
+        game.move_unit(game.unit_from_id(2), HexCoord(q=0, r=0, s=0), cost=0)
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+from src.game_logic.actions import Action, action_log_storage, apply_action
+from src.game_logic.archive import (
+    ArchivingStorage,
+    GameArchive,
+    export_games,
+    import_games,
+    read_archive,
+)
+from src.game_logic.board import HexBoard
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.session import SessionStore
+from src.game_logic.sqlite_storage import SqliteStorage
+from src.game_logic.storage import FileStorage
+
+
+@pytest.fixture
+def tempdir():
+    with tempfile.TemporaryDirectory() as tempdir:
+        yield tempdir
+
+
+def build_game(version: int) -> Game:
+    game = Game.build_empty(
+        board=HexBoard.build_circular(3),
+        players=[Player(id=idx, budget=10) for idx in range(2)],
+    )
+    game.version = version
+    return game
+
+
+def test_export_import(tempdir: str):
+    os.makedirs(os.path.join(tempdir, "files"))
+    source = FileStorage(os.path.join(tempdir, "files"))
+    for game_id in range(5):
+        source.save(game_id, build_game(game_id))
+    path = os.path.join(tempdir, "games.jsonl.gz")
+    assert export_games(source, path) == 5
+    assert sorted(game_id for game_id, _ in read_archive(path)) == list(
+        range(5)
+    )
+
+    target = SqliteStorage(tempdir)
+    assert import_games(target, path) == 5
+    for game_id in range(5):
+        assert target.load(game_id) == source.load(game_id)
+    target.close()
+
+
+def test_archiving_storage(tempdir: str):
+    storage = ArchivingStorage(FileStorage(tempdir), ttl=0.0)
+    store = SessionStore(storage)
+    game_ids = [store.create(build_game(version)) for version in range(3)]
+    store.clear()
+
+    # idle games are moved to the archive, except locked ones
+    with storage.lock(game_ids[0]):
+        assert storage.archive_idle() == 2
+    assert storage.storage.exists(game_ids[0])
+    assert not storage.storage.exists(game_ids[1])
+    assert storage.exists(game_ids[1])
+    assert sorted(storage.game_ids()) == game_ids
+    assert storage.new_id() == 3
+
+    # and brought back when loaded, also by another process
+    other_archive = GameArchive(storage.archive.path)
+    assert game_ids[1] in other_archive
+    assert store.get(game_ids[1]).version == 1
+    assert storage.storage.exists(game_ids[1])
+    assert game_ids[1] not in other_archive
+    assert game_ids[2] in other_archive
+    assert other_archive.load(game_ids[2]).version == 2
+
+    # the archive file holds every game archived
+    assert (
+        sorted(game_id for game_id, _ in read_archive(storage.archive.path))
+        == game_ids[1:]
+    )
+
+
+def test_archiving_action_log(tempdir: str):
+    storage = ArchivingStorage(action_log_storage(tempdir), ttl=0.0)
+    store = SessionStore(storage)
+    game_id = store.create(build_game(0))
+
+    def end_turn(player_id: int):
+        action = Action(
+            action_type="end_turn",
+            params={"game_id": game_id, "player_id": player_id},
+        )
+        with store.acquire(game_id) as game:
+            apply_action(game, action)
+            record = {
+                "version": game.version,
+                "action": action.model_dump(mode="json"),
+            }
+            store.append(game_id, record)
+
+    # games in memory are not archived, even if their storage looks idle
+    assert storage.archive_idle() == 0
+    end_turn(0)
+    store.clear()
+    assert store.get(game_id).version == 1
+
+    # idleness accounts for the log, the snapshot is older
+    snapshot_path = storage.storage.path(game_id)
+    os.utime(snapshot_path, (0, 0))
+    assert storage.storage.updated_at(game_id) > 0
+    assert storage.list_games(before=1.0) == []
+
+    # a record of a game deleted meanwhile is not logged without snapshot
+    storage.storage.delete(game_id)
+    end_turn(1)
+    assert os.path.exists(snapshot_path)
+    store.clear()
+    assert store.get(game_id).version == 2
+
+
+@pytest.mark.parametrize("storage_class", [FileStorage, SqliteStorage])
+def test_archive_idle_pages(tempdir: str, storage_class, monkeypatch):
+    # games updated at the same time are all archived, across pages
+    monkeypatch.setattr("src.game_logic.archive.ARCHIVE_BATCH", 2)
+    live = storage_class(tempdir)
+    for game_id in range(5):
+        live.save(game_id, build_game(game_id))
+    if isinstance(live, SqliteStorage):
+        with live._connection() as connection:
+            connection.execute("UPDATE games SET updated_at = 1000.0")
+    else:
+        for game_id in range(5):
+            os.utime(live.path(game_id), (1000.0, 1000.0))
+    page = live.list_games(limit=2)
+    assert [info.id for info in page] == [4, 3]
+    page = live.list_games(2, page[-1].updated_at, page[-1].id)
+    assert [info.id for info in page] == [2, 1]
+
+    # in a thread of its own
+    storage = ArchivingStorage(live, ttl=0.0, interval=0.01)
+    storage.maintain()
+    deadline = time.monotonic() + 5.0
+    while list(live.game_ids()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    storage.stop()
+    assert list(live.game_ids()) == []
+    assert sorted(storage.game_ids()) == list(range(5))
@@ -1,14 +1,42 @@
 import json
+import os
+import tempfile
 from typing import Tuple
 
+import numpy as np
 import pytest
+from pydantic import ValidationError
 
-from src.game_logic.board import HexBoard, HexCoord
+from src.game_logic.board import (
+    CELL_CODE_FROM_TYPE,
+    CellType,
+    HexBoard,
+    HexCoord,
+)
+from src.game_logic.board_cache import BoardCache, BoardPool
 from src.game_logic.city import City
-from src.game_logic.dice import DiceSet
+from src.game_logic.dice import DiceSet, win_probability
+from src.game_logic.exceptions import IllegalActionException
 from src.game_logic.game import Game
+from src.game_logic.pathfinding import distance_field, find_path
 from src.game_logic.player import Player
-from src.game_logic.units import Unit, UnitType, Worker
+from src.game_logic.serialization import (
+    SERIALIZERS,
+    get_serializer,
+    set_serializer,
+)
+from src.game_logic.terrain_generation.perlin_noise import (
+    THRESHOLDS,
+    generate_world,
+)
+from src.game_logic.units import (
+    UNIT_STATS_PATH,
+    Unit,
+    UnitStats,
+    UnitType,
+    Worker,
+    reload_unit_stats,
+)
 
 
 @pytest.mark.parametrize("radius", [5, 10, 23])
@@ -19,6 +47,42 @@ def test_board(radius: int):
     assert board == board2
 
 
+@pytest.mark.parametrize("radius", [0, 5, 23])
+def test_packed_board(radius: int):
+    board = HexBoard.build_circular(radius=radius)
+    board2 = HexBoard.from_bytes(board.to_bytes())
+    assert board2.radius == radius
+    assert board == board2
+    board3 = HexBoard(**json.loads(json.dumps(board.to_packed_dict())))
+    assert board == board3
+    assert board3.model_dump(mode="json") == board.model_dump(mode="json")
+
+
+@pytest.mark.parametrize("packed", ["", "AA==", "AQA="])
+def test_invalid_packed_board(packed: str):
+    # shorter than the header, or than the cells of its radius
+    with pytest.raises(ValidationError):
+        HexBoard.model_validate({"radius": 3, "packed": packed})
+
+
+@pytest.mark.parametrize("radius", [0, 3, 10])
+def test_board_get_cell(radius: int):
+    board = HexBoard.build_circular(radius=radius)
+    raw_board = board.model_dump()["raw_board"]
+    for q in range(-radius, radius + 1):
+        for r in range(-radius, radius + 1):
+            coord = HexCoord(q=q, r=r, s=-q - r)
+            if not board.valid_coord(coord):
+                assert abs(q + r) > radius
+                assert (
+                    raw_board[q + radius][r + radius]["type"] == CellType.empty
+                )
+                continue
+            cell = board.get_cell(coord)
+            assert cell.model_dump() == raw_board[q + radius][r + radius]
+            assert cell.type != CellType.empty
+
+
 @pytest.mark.parametrize("coords", [(2, 3, -5), (15, 5, -20), (10, 5, -15)])
 def test_coord(coords: Tuple[int, int, int]):
     coord = HexCoord(q=coords[0], r=coords[1], s=coords[2])
@@ -26,6 +90,32 @@ def test_coord(coords: Tuple[int, int, int]):
     assert coord == coord2
 
 
+@pytest.mark.parametrize("radius", [0, 1, 4])
+def test_coord_ring_and_range(radius: int):
+    center = HexCoord(q=2, r=-1, s=-1)
+    ring = list(center.ring(radius))
+    assert len(ring) == max(1, 6 * radius)
+    assert len(set(ring)) == len(ring)
+    assert all(center.distance(coord) == radius for coord in ring)
+    assert all(sum(coord) == 0 for coord in ring)
+
+    coords_in_range = set(center.range(radius))
+    assert coords_in_range == {
+        coord for n in range(radius + 1) for coord in center.ring(n)
+    }
+    assert set(center.neighbors()) == set(center.ring(1))
+
+
+def test_coord_validation():
+    location = {"q": 1, "r": 1, "s": 1}
+    with pytest.raises(ValidationError):
+        Unit(location=location, owner_id=0, id=0, type="warrior", actions=0)
+    location["s"] = -2
+    unit = Unit(location=location, owner_id=0, id=0, type="warrior", actions=0)
+    assert unit.location == HexCoord(q=1, r=1, s=-2)
+    assert {unit.location: unit}[HexCoord(q=1, r=1, s=-2)] is unit
+
+
 @pytest.mark.parametrize(
     "id, budget, worker_to_place", [(0, 10, True), (2, 3, False), (1, 0, True)]
 )
@@ -53,6 +143,38 @@ def test_unit(location, owner_id, id, type):
     assert unit == unit2
 
 
+def test_unit_stats_reload():
+    unit = Unit(
+        location=HexCoord(0, 0, 0),
+        owner_id=0,
+        id=0,
+        type=UnitType.warrior,
+        actions=0,
+    )
+    assert unit.stats is unit.stats
+    assert unit.stats is UnitStats.from_type(UnitType.warrior)
+
+    with open(UNIT_STATS_PATH) as f:
+        stats_dict = json.load(f)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "units_stats.json")
+        with open(path, "w") as f:
+            json.dump({"warrior": stats_dict["warrior"]}, f)
+        with pytest.raises(ValueError):
+            reload_unit_stats(path)
+        assert unit.stats.movement == stats_dict["warrior"]["movement"]
+
+        stats_dict["warrior"]["movement"] += 1
+        with open(path, "w") as f:
+            json.dump(stats_dict, f)
+        try:
+            reload_unit_stats(path)
+            unit.reset_upkeep()
+            assert unit.actions == stats_dict["warrior"]["movement"]
+        finally:
+            reload_unit_stats()
+
+
 @pytest.mark.parametrize(
     "board, players, units, cities, current_player_idx",
     [
@@ -117,3 +239,290 @@ def test_diceset(diceset_str):
         mean_roll += diceset.roll()
     mean_roll /= N
     assert abs(mean_roll - expected) < 0.1
+
+
+@pytest.mark.parametrize("diceset_str", ["4d10", "5d5", "d6 d0", ""])
+def test_diceset_roll_many(diceset_str):
+    diceset = DiceSet.from_dice_code(diceset_str)
+    rolls = diceset.roll_many(100_000, np.random.default_rng(0))
+    assert rolls.shape == (100_000,)
+    assert abs(rolls.mean() - diceset.expected()) < 0.1
+    assert (
+        rolls == diceset.roll_many(100_000, np.random.default_rng(0))
+    ).all()
+
+
+@pytest.mark.parametrize(
+    "worker_locations, valid",
+    [
+        ([], True),
+        ([(1, 0), (2, 0), (3, -1)], True),
+        ([(0, 1), (0, 2), (-1, 3), (2, -1)], False),
+        ([(2, 0), (3, 0)], False),
+        ([(q, 0) for q in range(1, 5000)], True),
+    ],
+)
+def test_city_workers_connected(worker_locations, valid):
+    workers = [
+        Worker(location=HexCoord(q, r, -q - r), id=id, yields=1)
+        for id, (q, r) in enumerate(worker_locations)
+    ]
+    city_dict = {
+        "location": HexCoord(0, 0, 0),
+        "owner_id": 0,
+        "id": 0,
+        "workers": workers,
+    }
+    if not valid:
+        with pytest.raises(ValidationError):
+            City(**city_dict)
+        return
+    city = City(**city_dict)
+    last = workers[-1].location if workers else city.location
+    assert city.is_worker_location_valid(
+        HexCoord(last.q + 1, last.r, last.s - 1)
+    )
+    assert not city.is_worker_location_valid(HexCoord(-2, 0, 2))
+
+    clone = city.clone()
+    clone.add_worker(Worker(location=HexCoord(-1, 0, 1), id=-1, yields=1))
+    assert clone.is_worker_location_valid(HexCoord(-2, 0, 2))
+    assert not city.is_worker_location_valid(HexCoord(-2, 0, 2))
+    assert len(city.workers) == len(workers)
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_game_from_trusted_dict(packed: bool):
+    game = Game(
+        board=HexBoard.build_circular(5),
+        players=[Player(id=0, budget=10), Player(id=1, budget=3)],
+        units=[
+            Unit(
+                location=HexCoord(q=idx, r=0, s=-idx),
+                id=idx,
+                owner_id=idx % 2,
+                type=UnitType.knight,
+                actions=idx,
+            )
+            for idx in range(3)
+        ],
+        cities=[
+            City(
+                location=HexCoord(q=-2, r=0, s=2),
+                owner_id=1,
+                id=0,
+                workers=[
+                    Worker(location=HexCoord(q=-2, r=1, s=1), id=0, yields=2)
+                ],
+            )
+        ],
+        current_player_idx=1,
+        version=7,
+    )
+    if packed:
+        game_dict = game.to_packed_dict(include_rng=True)
+    else:
+        game_dict = game.model_dump(mode="json")
+    game_dict = json.loads(json.dumps(game_dict))
+
+    trusted_game = Game.from_trusted_dict(game_dict)
+    assert trusted_game.model_dump() == Game(**game_dict).model_dump()
+    assert trusted_game.unit_from_id(2).location == HexCoord(q=2, r=0, s=-2)
+    assert trusted_game.cities[0].is_worker_location_valid(
+        HexCoord(q=-2, r=2, s=0)
+    )
+    if packed:
+        assert trusted_game.rng.random() == game.rng.random()
+
+
+@pytest.mark.parametrize("serializer_name", list(SERIALIZERS))
+def test_game_packed_json(serializer_name: str):
+    game = Game.build_empty(
+        board=HexBoard.build_circular(5),
+        players=[Player(id=0, budget=10), Player(id=1, budget=3)],
+    )
+    game.rng.random()
+    set_serializer(serializer_name)
+    try:
+        serializer = get_serializer()
+        for include_rng in [False, True]:
+            game_json = game.to_packed_json(include_rng=include_rng)
+            game_dict = serializer.loads(game_json)
+            assert game_dict == game.to_packed_dict(include_rng=include_rng)
+        game2 = Game.from_trusted_dict(game_dict)
+        assert game2.rng.random() == game.rng.random()
+        assert serializer.loads(serializer.dumps(game)) == game.model_dump(
+            mode="json"
+        )
+    finally:
+        set_serializer("orjson" if "orjson" in SERIALIZERS else "json")
+
+
+def test_game_indexes():
+    game = Game.build_empty(
+        board=HexBoard.build_circular(5, thresholds=[-1.0, 1.0, 1.0]),
+        players=[Player(id=0, budget=10), Player(id=1, budget=10)],
+    )
+    for idx in range(3):
+        game.add_unit(
+            Unit(
+                location=HexCoord(q=idx, r=0, s=-idx),
+                id=game.new_unit_id(),
+                owner_id=idx % 2,
+                type=UnitType.knight,
+                actions=4,
+            )
+        )
+    assert [unit.id for unit in game.units] == [0, 1, 2]
+
+    unit = game.unit_from_id(1)
+    assert game.unit_from_location(HexCoord(q=1, r=0, s=-1)) is unit
+    game.move_unit(unit, HexCoord(q=1, r=2, s=-3))
+    assert game.unit_from_location(HexCoord(q=1, r=0, s=-1)) is None
+    assert game.unit_from_location(HexCoord(q=1, r=2, s=-3)) is unit
+
+    game.remove_unit(game.unit_from_id(0))
+    assert game.unit_from_location(HexCoord(q=0, r=0, s=0)) is None
+    with pytest.raises(ValueError):
+        game.unit_from_id(0)
+    assert game.new_unit_id() == 3
+
+    game2 = Game(**json.loads(json.dumps(game.model_dump(mode="json"))))
+    for unit in game2.units:
+        assert game2.unit_from_location(unit.location) is unit
+        assert game2.unit_from_id(unit.id) is unit
+    assert game2.player_from_id(1) is game2.players[1]
+
+
+def test_pathfinding():
+    # plain board with a ridge of mountains on q == 1, except for a pass at
+    # r == -3, and hills on q == -1
+    board = HexBoard.build_circular(4, thresholds=[-1.0, 1.0, 1.0])
+    cell_types = bytearray(board.cell_types)
+    for coord in HexCoord(0, 0, 0).range(4):
+        if coord.q == 1 and coord.r != -3:
+            cell_type = CellType.mauntain
+        elif coord.q == -1:
+            cell_type = CellType.hills
+        else:
+            continue
+        cell_types[_board_index(board, coord)] = CELL_CODE_FROM_TYPE[cell_type]
+    board = HexBoard(
+        radius=4, cell_types=bytes(cell_types), cell_yields=board.cell_yields
+    )
+
+    origin = HexCoord(0, 0, 0)
+    field = distance_field(board, UnitType.knight, origin, max_cost=3)
+    assert field[origin] == 0
+    assert field[HexCoord(0, 3, -3)] == 3
+    assert field[HexCoord(-1, 0, 1)] == 2
+    assert field[HexCoord(-2, 0, 2)] == 3
+    assert HexCoord(-3, 0, 3) not in field
+    assert HexCoord(1, 0, -1) not in field
+    assert HexCoord(2, -1, -1) not in field
+
+    path = find_path(board, UnitType.knight, origin, HexCoord(2, 0, -2))
+    assert path[0] == origin and path[-1] == HexCoord(2, 0, -2)
+    assert HexCoord(1, -3, 2) in path
+    assert all(a.distance(b) == 1 for a, b in zip(path, path[1:]))
+    field = distance_field(board, UnitType.knight, origin, max_cost=20)
+    assert len(path) - 1 == field[HexCoord(2, 0, -2)]
+    assert (
+        find_path(board, UnitType.knight, origin, HexCoord(1, 0, -1)) is None
+    )
+
+    blocked = {HexCoord(1, -3, 2)}
+    assert (
+        find_path(board, UnitType.knight, origin, HexCoord(2, 0, -2), blocked)
+        is None
+    )
+
+    game = Game.build_empty(
+        board=board, players=[Player(id=0, budget=10), Player(id=1, budget=10)]
+    )
+    knight = Unit(
+        location=origin, owner_id=0, id=0, type=UnitType.knight, actions=4
+    )
+    game.add_unit(knight)
+    with pytest.raises(IllegalActionException):
+        game.move_unit(knight, HexCoord(1, 0, -1))
+    assert game.reachable(knight)[HexCoord(0, 3, -3)] == 3
+
+    # units walk through their owner's units, not through enemies
+    for owner_id in [0, 1]:
+        game.add_unit(
+            Unit(
+                location=HexCoord(0, 1, -1),
+                owner_id=owner_id,
+                id=1,
+                type=UnitType.warrior,
+                actions=0,
+            )
+        )
+        reachable = HexCoord(0, 3, -3) in game.reachable(knight)
+        assert reachable == (owner_id == 0)
+        game.remove_unit(game.unit_from_id(1))
+    game.move_unit(knight, HexCoord(0, 3, -3))
+    assert knight.actions == 1
+
+
+def _board_index(board: HexBoard, coord: HexCoord) -> int:
+    return (coord.q + board.radius) * board.side_size + coord.r + board.radius
+
+
+@pytest.mark.parametrize("width, height", [(1, 1), (21, 21), (30, 7)])
+def test_generate_world(width: int, height: int):
+    world = generate_world(width, height, seed=42)
+    assert world.shape == (height, width)
+    assert world.min() >= 0 and world.max() <= len(THRESHOLDS)
+    assert (world == generate_world(width, height, seed=42)).all()
+
+
+def test_board_cache():
+    with tempfile.TemporaryDirectory() as tempdir:
+        cache = BoardCache(cache_dir=tempdir, max_boards=1)
+        board = cache.get(radius=5, seed=3)
+        assert board == HexBoard.build_circular(radius=5, seed=3)
+        assert cache.get(radius=5, seed=3) is board
+        assert cache.get(radius=5, seed=4) != board
+
+        # evicted from memory, loaded from disk
+        assert cache.get(radius=5, seed=3) is not board
+        assert cache.get(radius=5, seed=3) == board
+        assert len(os.listdir(tempdir)) == 2
+
+
+def test_board_pool():
+    pool = BoardPool(radii=[3], pool_size=2)
+    pool.fill()
+    boards = [pool.take(3) for _ in range(3)]
+    assert all(board.radius == 3 for board in boards)
+    assert boards[0] != boards[1]
+    assert pool.take(4).radius == 4
+
+
+@pytest.mark.parametrize(
+    "diceset_str", ["4d10", "5d5", "1d2", "3d3", "d6 2d4", "d0", ""]
+)
+def test_diceset_distribution(diceset_str):
+    diceset = DiceSet.from_dice_code(diceset_str)
+    distribution = diceset.distribution()
+    assert distribution.sum() == pytest.approx(1)
+    assert np.dot(np.arange(len(distribution)), distribution) == pytest.approx(
+        diceset.expected()
+    )
+    assert diceset.roll() < len(distribution)
+
+
+@pytest.mark.parametrize(
+    "attack_str, defense_str", [("d6", "d6"), ("2d6 d12", "d12"), ("d4", "")]
+)
+def test_win_probability(attack_str, defense_str):
+    attack = DiceSet.from_dice_code(attack_str)
+    defense = DiceSet.from_dice_code(defense_str)
+    probability = win_probability(
+        attack.distribution(), defense.distribution()
+    )
+    N = 100_000
+    wins = sum(attack.roll() > defense.roll() for _ in range(N))
+    assert abs(wins / N - probability) < 0.01
@@ -0,0 +1,49 @@
+import asyncio
+import json
+import threading
+
+from src.app.hub import GameHub
+from src.game_logic.delta import GameDelta
+
+
+def delta(version: int) -> GameDelta:
+    return GameDelta(
+        from_version=version - 1, version=version, current_player_idx=0
+    )
+
+
+def test_hub_broadcast():
+    async def main():
+        hub = GameHub()
+        queues = [hub.subscribe(0), hub.subscribe(0)]
+        other_queue = hub.subscribe(1)
+        hub.publish(0, delta(1))
+        # from a worker thread, like the sync endpoints
+        thread = threading.Thread(target=hub.publish, args=(0, delta(2)))
+        thread.start()
+        thread.join()
+        for queue in queues:
+            for version in [1, 2]:
+                message = await asyncio.wait_for(queue.get(), 1)
+                assert json.loads(message)["version"] == version
+        assert other_queue.empty()
+
+        hub.unsubscribe(0, queues[0])
+        hub.publish(0, delta(3))
+        await asyncio.sleep(0)
+        assert queues[0].empty()
+        assert len(hub) == 2
+
+    asyncio.run(main())
+
+
+def test_hub_drops_slow_subscribers():
+    async def main():
+        hub = GameHub(max_queue=3)
+        queue = hub.subscribe(0)
+        for version in range(1, 5):
+            hub.publish(0, delta(version))
+        assert len(hub) == 0
+        assert await queue.get() is None
+
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+from src.game_logic.metrics import Counter, Histogram, Registry
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.register(
+        Counter("requests_total", "Requests", ["path"])
+    )
+    histogram = registry.register(
+        Histogram("latency_seconds", "Latency", buckets=[0.1, 1.0])
+    )
+    counter.inc("/game")
+    counter.inc('/a"b')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    # as collected from another process
+    other = registry.collect()
+    lines = registry.render(other).decode().splitlines()
+    assert lines == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b"} 2.0',
+        'requests_total{path="/game"} 2.0',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2.0',
+        'latency_seconds_bucket{le="1.0"} 4.0',
+        'latency_seconds_bucket{le="+Inf"} 6.0',
+        "latency_seconds_sum 11.1",
+        "latency_seconds_count 6.0",
+    ]
+    assert histogram.count() == 3
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import pytest
+
+from src.game_logic.actions import Action, action_log_storage, take_action
+from src.game_logic.board import HexBoard, HexCoord
+from src.game_logic.city import City
+from src.game_logic.exceptions import (
+    GameConflictException,
+    IllegalActionException,
+)
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.session import (
+    SessionStore,
+    get_game,
+    get_session_store,
+    set_shared_storage,
+    set_storage_factory,
+)
+from src.game_logic.storage import FileStorage
+from src.game_logic.units import Unit, UnitType
+
+
+@pytest.fixture
+def storage():
+    with tempfile.TemporaryDirectory() as tempdir:
+        yield FileStorage(tempdir)
+
+
+def build_game(n_players: int = 2) -> Game:
+    return Game(
+        board=HexBoard.build_circular(3),
+        players=[Player(id=idx, budget=10) for idx in range(n_players)],
+        units=[
+            Unit(
+                location=HexCoord(q=0, r=0, s=0),
+                owner_id=0,
+                id=0,
+                type=UnitType.warrior,
+                actions=2,
+            )
+        ],
+        cities=[],
+        current_player_idx=0,
+    )
+
+
+def test_write_behind(storage: FileStorage):
+    store = SessionStore(storage)
+    game_id = store.create(build_game(), None)
+    assert game_id == 0
+    assert os.path.exists(storage.path(game_id))
+
+    with store.acquire(game_id) as game:
+        game.units[0].actions = 0
+        store.append(game_id, {})
+    assert store.get(game_id) is game
+    assert storage.load(game_id).units[0].actions == 2
+
+    store.flush()
+    assert storage.load(game_id).units[0].actions == 0
+
+
+def test_failed_write_is_not_flushed(storage: FileStorage):
+    store = SessionStore(storage)
+    game_id = store.create(build_game(), None)
+    # the game is dropped, and reloaded as stored
+    with pytest.raises(ValueError):
+        with store.acquire(game_id) as game:
+            game.units[0].actions = 0
+            store.append(game_id, {})
+            raise ValueError()
+    assert game_id not in store
+    assert store.get(game_id).units[0].actions == 2
+
+    # a rejected action leaves the game in memory untouched, here a worker
+    # out of the board next to a city on the edge
+    game = build_game()
+    game.cities = [
+        City(
+            location=HexCoord(q=3, r=0, s=-3),
+            owner_id=0,
+            id=0,
+            name="edge",
+            workers=[],
+            actions=1,
+        )
+    ]
+    game.reindex()
+    store = get_session_store(storage.file_dir)
+    game_id = store.create(game)
+    action = {
+        "action_type": "build_worker",
+        "params": {
+            "game_id": game_id,
+            "player_id": 0,
+            "city_id": 0,
+            "location": {"q": 4, "r": -1, "s": -3},
+        },
+    }
+    with pytest.raises(IllegalActionException):
+        take_action(Action(**action), storage.file_dir)
+    assert store.get(game_id) is game
+    assert game.cities[0].actions == 1
+    assert game.version == 0
+
+
+def test_eviction(storage: FileStorage):
+    store = SessionStore(storage, max_games=2)
+    game_ids = [store.create(build_game(), None) for _ in range(3)]
+    assert game_ids == [0, 1, 2]
+    assert len(store) == 2
+    assert 0 not in store
+
+    with store.acquire(1) as game:
+        game.current_player_idx = 1
+        store.append(1, {})
+    store.get(0)
+    assert 2 not in store
+    store.get(2)
+    assert 1 not in store
+    assert storage.load(1).current_player_idx == 1
+
+    store.ttl = 0
+    store.evict()
+    assert len(store) == 0
+
+
+def test_acquire_async(storage: FileStorage):
+    store = SessionStore(storage)
+    game_id = store.create(build_game(), None)
+    store.clear()
+
+    async def increment(game_id: int):
+        async with store.acquire_async(game_id) as game:
+            actions = game.units[0].actions
+            await asyncio.sleep(0)
+            game.units[0].actions = actions + 1
+            await store.append_async(game_id, {})
+
+    async def main():
+        # loaded in a thread, coroutines do not interleave inside acquire
+        await asyncio.gather(*(increment(game_id) for _ in range(10)))
+        assert (await store.get_async(game_id)).units[0].actions == 12
+
+        # a lock held by another thread is waited for without blocking
+        session = store._sessions[game_id]
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with session.lock:
+                locked.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+        task = asyncio.create_task(increment(game_id))
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        release.set()
+        await task
+        thread.join()
+
+        new_game_id = await store.create_async(build_game())
+        assert new_game_id == game_id + 1
+
+    asyncio.run(main())
+    assert store.get(game_id).units[0].actions == 13
+    store.flush()
+    assert storage.load(game_id).units[0].actions == 13
+
+
+def test_storage_lock(storage: FileStorage):
+    game_id = storage.new_id()
+    assert storage.new_id() == game_id + 1
+    assert storage.revision(game_id) == 0
+    storage.save(game_id, build_game())
+    assert storage.revision(game_id) == 1
+
+    with storage.lock(game_id):
+        with pytest.raises(GameConflictException):
+            with storage.lock(game_id, timeout=0.01):
+                pass
+        with storage.lock(game_id + 1, timeout=0.01):
+            pass
+
+
+def end_turns(
+    file_dir: str, game_ids: List[int], n_turns: int, action_log: bool
+) -> None:
+    # one uvicorn worker, retrying the actions rejected as stale
+    set_shared_storage(True)
+    if action_log:
+        set_storage_factory(action_log_storage)
+    for turn in range(n_turns):
+        for game_id in game_ids:
+            while True:
+                params = {"game_id": game_id, "player_id": 0}
+                if turn % 2:
+                    # acting on what was read, as a client does
+                    version = get_game(game_id, file_dir=file_dir).version
+                    params["expected_version"] = version
+                try:
+                    take_action(
+                        Action(action_type="end_turn", params=params),
+                        file_dir=file_dir,
+                    )
+                    break
+                except GameConflictException:
+                    continue
+
+
+@pytest.mark.parametrize("action_log", [False, True])
+def test_shared_storage_processes(storage: FileStorage, action_log: bool):
+    n_processes, n_turns = 4, 25
+    store = SessionStore(storage)
+    game_ids = [store.create(build_game(n_players=1)) for _ in range(2)]
+    with ProcessPoolExecutor(n_processes) as executor:
+        futures = [
+            executor.submit(
+                end_turns, storage.file_dir, game_ids, n_turns, action_log
+            )
+            for _ in range(n_processes)
+        ]
+        for future in futures:
+            future.result()
+
+    # no action was lost
+    if action_log:
+        storage = action_log_storage(storage.file_dir)
+    for game_id in game_ids:
+        assert storage.load(game_id).version == n_processes * n_turns
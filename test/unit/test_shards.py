@@ -0,0 +1,73 @@
+import asyncio
+import json
+import tempfile
+
+import pytest
+
+from src.game_logic.board import HexBoard
+from src.game_logic.exceptions import IllegalActionException
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.shards import ShardPool
+from src.game_logic.storage import FileStorage
+
+
+def end_turn(game_id: int, player_id: int = 0) -> str:
+    return json.dumps(
+        {
+            "action_type": "end_turn",
+            "params": {"game_id": game_id, "player_id": player_id},
+        }
+    )
+
+
+def test_shard_pool():
+    game = Game.build_empty(
+        board=HexBoard.build_circular(3),
+        players=[Player(id=0, budget=10)],
+    )
+    with tempfile.TemporaryDirectory() as tempdir:
+        pool = ShardPool(2, tempdir)
+        pool.start()
+
+        async def main():
+            game_ids = [0, 1, 2]
+            assert pool.shard(0) is pool.shard(2)
+            assert pool.shard(0) is not pool.shard(1)
+            for game_id in game_ids:
+                await pool.call(
+                    game_id, "new_game", game.to_packed_json(include_rng=True)
+                )
+
+            # games on different shards are served concurrently
+            responses = await asyncio.gather(
+                *(
+                    pool.call(game_id, "take_action", end_turn(game_id), True)
+                    for game_id in game_ids
+                    for _ in range(5)
+                )
+            )
+            for response, delta_json in responses:
+                assert response == delta_json
+            game_json = await pool.call(2, "get_game", False, None)
+            assert json.loads(game_json)["version"] == 5
+
+            with pytest.raises(IllegalActionException):
+                await pool.call(0, "take_action", end_turn(0, 1), False)
+
+            # a crashed shard is restarted, its games are reloaded
+            crashed = pool.shard(1).process
+            crashed.kill()
+            while pool.shard(1).process is crashed:
+                await asyncio.sleep(0.01)
+            # with its acknowledged actions, written through
+            response, _ = await pool.call(1, "take_action", end_turn(1), False)
+            assert json.loads(response)["version"] == 6
+
+        try:
+            asyncio.run(main())
+        finally:
+            pool.stop()
+
+        # the shards flush their games when they stop
+        assert FileStorage(tempdir).load(0).version == 5
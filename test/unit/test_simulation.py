@@ -0,0 +1,66 @@
+import pytest
+
+from src.game_logic.actions import Action, ActionType, apply_action
+from src.game_logic.legal_actions import LegalActionsCache, legal_actions
+from src.game_logic.simulation import (
+    play_game,
+    random_policy,
+    run_batch,
+    setup_game,
+    simulate,
+)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_legal_actions_are_accepted(seed: int):
+    game = setup_game(radius=5, n_players=2, seed=seed)
+    for _ in range(60):
+        player_id = game.current_player.id
+        actions = legal_actions(game, player_id)
+        assert actions[-1].action_type == ActionType.end_turn
+        assert legal_actions(game, 1 - player_id) == []
+        for action in actions:
+            # every enumerated action passes validation and the rules
+            Action(**action.model_dump())
+            apply_action(game.clone(), action)
+        apply_action(game, random_policy(game, actions, game.rng))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_legal_actions_cache(seed: int):
+    game = setup_game(radius=4, n_players=2, seed=seed)
+    for _ in range(300):
+        player_id = game.current_player.id
+        actions = legal_actions(game, player_id)
+        assert legal_actions(game, player_id) is actions
+        fresh_actions = LegalActionsCache().get(game, player_id, 0)
+        assert [a.model_dump() for a in actions] == [
+            a.model_dump() for a in fresh_actions
+        ]
+        apply_action(game, random_policy(game, actions, game.rng))
+
+
+def test_clone():
+    game = setup_game(radius=5, n_players=2, seed=0)
+    play_game(game, max_turns=3)
+    clone = game.clone()
+    assert clone == game
+    assert clone.board is game.board
+    assert clone.rng.random() == game.rng.random()
+
+    play_game(clone, max_turns=3)
+    assert clone.version > game.version
+    assert len(clone.units) != len(game.units)
+
+
+def test_simulate_is_reproducible():
+    result = simulate(seed=3, radius=5, max_turns=5)
+    assert result.turns == 5
+    assert result == simulate(seed=3, radius=5, max_turns=5)
+
+
+def test_run_batch():
+    report = run_batch(n_games=3, n_workers=0, radius=5, max_turns=3)
+    assert report.games == 3
+    assert report.draws + sum(report.wins.values()) == 3
+    assert report.games_per_second > 0
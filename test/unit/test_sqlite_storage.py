@@ -0,0 +1,64 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.game_logic.board import HexBoard
+from src.game_logic.game import Game
+from src.game_logic.player import Player
+from src.game_logic.session import SessionStore
+from src.game_logic.sqlite_storage import SqliteStorage
+
+
+@pytest.fixture
+def storage():
+    with tempfile.TemporaryDirectory() as tempdir:
+        storage = SqliteStorage(tempdir, pool_size=2)
+        yield storage
+        storage.close()
+
+
+def build_game(n_players: int = 2) -> Game:
+    return Game.build_empty(
+        board=HexBoard.build_circular(3),
+        players=[Player(id=idx, budget=10) for idx in range(n_players)],
+    )
+
+
+def test_sqlite_storage(storage: SqliteStorage):
+    # ids are unique under concurrency, and only taken once saved
+    with ThreadPoolExecutor(8) as executor:
+        game_ids = list(executor.map(lambda _: storage.new_id(), range(20)))
+    assert sorted(game_ids) == list(range(20))
+    assert not storage.exists(0)
+    with pytest.raises(FileNotFoundError):
+        storage.load(0)
+    assert storage.list_games() == []
+
+    game = build_game()
+    storage.save(0, game)
+    game.version = 3
+    game.current_player_idx = 1
+    storage.save(0, game)
+    assert storage.exists(0)
+    assert storage.revision(0) == 2
+    assert storage.load(0) == game
+
+    storage.save(25, build_game(n_players=3))
+    games = storage.list_games()
+    assert [info.id for info in games] == [25, 0]
+    assert games[1].version == 3
+    assert games[1].current_player_id == 1
+    assert games[0].n_players == 3
+    assert storage.list_games(before=games[0].updated_at) == games[1:]
+    assert storage.new_id() == 26
+
+
+def test_sqlite_session_store(storage: SqliteStorage):
+    store = SessionStore(storage)
+    game_id = store.create(build_game())
+    with store.acquire(game_id) as game:
+        game.version = 1
+        store.append(game_id, {})
+    store.clear()
+    assert store.get(game_id).version == 1